@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the bot's hot paths.
+
+Usage: python benchmarks.py [benchmark ...] [--size N] [--backend sqlite|rqlite]
+                            [--import-budget-ms MS]
+
+Each benchmark gets a fresh throwaway database. With --backend rqlite
+they run against a storage_server.py stand-in per benchmark, or share
+RQLITE_URL when it is set.
+"""
+import os
+import sys
+import time
+import heapq
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+import subprocess
+
+# Modules main.py must only import when a command or mode needs them
+DEFERRED_MODULES = ('webhook', 'sharding', 'importer', 'image_store', 'images', 'PIL')
+
+# Benchmarks always run against a throwaway database
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="nguess-bench-"), "bench.db")
+
+import storage
+import database
+import characters
+import matching
+from storage_server import serve_in_thread
+
+def _report(name, calls, seconds):
+    """Print one benchmark result line"""
+    per_call = seconds / calls * 1e6
+    print(f"{name:<32} {calls:>9} calls  {per_call:>10.2f} µs/call  {calls / seconds:>12.0f} calls/s")
+
+def _seed_characters(size):
+    """Insert `size` synthetic characters in one transaction"""
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            'INSERT INTO characters (name, image_path) VALUES (?, ?)',
+            ((f"Character {i}", f"images/{i}.jpg") for i in range(size))
+        )
+
+# =============== BENCHMARKS ===============
+def bench_sampler(args):
+    """ORDER BY RANDOM() query vs the in-memory sampler"""
+    database.init_db()
+    _seed_characters(args.size)
+    print(f"Roster size: {args.size}")
+
+    calls = 200
+    start = time.perf_counter()
+    for _ in range(calls):
+        database.get_random_character()
+    _report("ORDER BY RANDOM() LIMIT 1", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    asyncio.run(characters.load_characters())
+    print(f"Sampler load: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    calls = 100000
+    start = time.perf_counter()
+    for _ in range(calls):
+        characters.get_random_character()
+    _report("sampler (uniform)", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        characters.get_random_character(i % 1000)
+    _report("sampler (no-repeat window)", calls, time.perf_counter() - start)
+
+    characters._weighted = True
+    start = time.perf_counter()
+    for i in range(calls):
+        characters.get_random_character(i % 1000)
+    _report("sampler (weighted + window)", calls, time.perf_counter() - start)
+    characters._weighted = False
+
+    # Rate every character with rounds that spread them over all buckets
+    records = list(characters._characters)
+    start = time.perf_counter()
+    for i, record in enumerate(records):
+        for j in range(characters.MIN_RATED_ROUNDS):
+            characters.record_result(record['id'], j < i % (characters.MIN_RATED_ROUNDS + 1))
+    _report("record_result (re-bucket)", len(records) * characters.MIN_RATED_ROUNDS, time.perf_counter() - start)
+    print("Difficulty buckets (easy/medium/hard): " + "/".join(str(len(b)) for b in characters._buckets))
+
+    for strike in (0, characters.MEDIUM_STRIKE, characters.HARD_STRIKE):
+        start = time.perf_counter()
+        for i in range(calls):
+            characters.get_random_character(i % 1000, strike)
+        _report(f"sampler (adaptive, strike {strike})", calls, time.perf_counter() - start)
+
+    # Every record sits once in the bucket its rate calls for, at its slot
+    consistent = all(
+        characters._buckets[record['bucket']][record['slot']] is record
+        and record['bucket'] == characters.difficulty(record)
+        for record in records
+    ) and sum(len(b) for b in characters._buckets) == len(records)
+    hard = characters.get_random_character(None, characters.HARD_STRIKE)
+    print(f"Bucket membership consistent: {consistent}")
+    print(f"Hard strike draws a hard character: {characters._by_id[hard['id']]['bucket'] == characters.HARD}")
+
+    # Custom weights apply inside the bucket: a hard character weighing as
+    # much as the rest of its bucket gets about half the hard draws
+    heavy_weight = float(len(characters._buckets[characters.HARD]))
+    characters.add_records([{
+        'id': -1, 'name': "Heavy", 'image_path': "images/heavy.jpg", 'weight': heavy_weight,
+        'rounds': characters.MIN_RATED_ROUNDS, 'correct': 0
+    }])
+    for i, record in enumerate(records[:1000]):
+        characters.record_result(record['id'], i % 2)
+    draws = 4000
+    start = time.perf_counter()
+    heavy = sum(characters.get_random_character(None, characters.HARD_STRIKE)['id'] == -1 for _ in range(draws))
+    _report("sampler (adaptive, weighted)", draws, time.perf_counter() - start)
+    weights_consistent = all(
+        abs(_fenwick_total(characters._bucket_trees[bucket]) - sum(r['weight'] for r in members)) < 1e-6 and
+        abs(characters._bucket_weights[bucket] - sum(r['weight'] for r in members)) < 1e-6
+        for bucket, members in enumerate(characters._buckets)
+    )
+    print(f"Bucket weights consistent: {weights_consistent}")
+    print(f"Weights apply within the bucket: {0.4 < heavy / draws < 0.6} ({heavy / draws:.0%} heavy draws)")
+
+def _fenwick_total(tree):
+    """Sum of every weight in a Fenwick tree"""
+    total = 0.0
+    index = len(tree) - 1
+    while index:
+        total += tree[index]
+        index -= index & -index
+    return total
+
+def bench_matching(args):
+    """Guess matching throughput against precomputed name indexes"""
+    names = [
+        "Naruto Uzumaki", "Monkey D. Luffy", "Kyōko Sakura", "Edward Elric",
+        "Levi Ackerman", "Satoru Gojo", "Lelouch vi Britannia", "Rem",
+        "Makise Kurisu", "Roronoa Zoro", "Light Yagami", "Mikasa Ackerman",
+    ]
+    guesses = [
+        "naruto", "luffy", "kyouko", "edward elrik", "ackerman levi", "gojo",
+        "lelouch", "ram", "kurisu makise", "zorro", "L", "sasuke uchiha",
+    ]
+
+    start = time.perf_counter()
+    indexes = [matching.build_index(name) for name in names for _ in range(1000)]
+    _report("build_index", len(indexes), time.perf_counter() - start)
+    forms = sum(len(index[0]) for index in indexes) / len(indexes)
+    print(f"Average accepted forms per character: {forms:.1f}")
+
+    calls = 100000
+    pairs = [(guesses[i % len(guesses)], indexes[(i * 7) % len(indexes)]) for i in range(calls)]
+    start = time.perf_counter()
+    for guess, index in pairs:
+        matching.match_guess(guess, index)
+    _report("match_guess (mixed)", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for guess, index in pairs:
+        guess.strip().lower() == names[0].strip().lower()
+    _report("old exact compare", calls, time.perf_counter() - start)
+
+def _check(results, label, ok):
+    """Record one conformance check"""
+    results.append((label, bool(ok)))
+
+def _user_change(username=None, coins=0, reset=False, strike=0, best_strike=0, total_correct=0, games_played=0):
+    """A change in the shape users.change_user queues for apply_user_changes"""
+    return {
+        'username': username,
+        'coins': coins,
+        'reset': reset,
+        'strike': strike,
+        'best_strike': best_strike,
+        'total_correct': total_correct,
+        'games_played': games_played
+    }
+
+def check_storage():
+    """Run every database function once against the current backend
+
+    Returns (label, passed) pairs; the same checks run on every backend.
+    """
+    results = []
+    database.init_db()
+    database.init_db()  # must be idempotent
+
+    char_id = database.insert_character("Conformance Alpha", "images/a.jpg", None, "h-a")
+    _check(results, "insert_character returns an id", isinstance(char_id, int))
+    _check(results, "duplicate name returns None",
+           database.insert_character("Conformance Alpha", "images/b.jpg") is None)
+    _check(results, "add_character", database.add_character("Conformance Beta", "images/b.jpg"))
+    inserted = database.insert_characters([
+        ("Conformance Gamma", "images/g.jpg", "h-g"),
+        ("Conformance Alpha", "images/dup.jpg", "h-dup"),
+    ])
+    _check(results, "insert_characters skips existing names",
+           [r['name'] for r in inserted] == ["Conformance Gamma"] and isinstance(inserted[0]['id'], int))
+    _check(results, "get_character_hashes", {"h-a", "h-g"} <= database.get_character_hashes())
+    database.set_character_file_id(char_id, "FILE")
+    records = {r['id']: r for r in database.get_character_records()}
+    _check(results, "get_character_records / set_character_file_id",
+           records[char_id]['file_id'] == "FILE" and records[char_id]['weight'] == 1.0)
+    _check(results, "get_character_records(after_id)",
+           all(r['id'] > char_id for r in database.get_character_records(char_id)))
+    database.set_character_image(char_id, "images/objects/a.jpg", "h-a2")
+    _check(results, "set_character_image / get_image_refs",
+           (char_id, "images/objects/a.jpg", "h-a2") in [tuple(r) for r in database.get_image_refs()])
+    _check(results, "get_all_characters is sorted",
+           database.get_all_characters() == sorted(database.get_all_characters()))
+    rows, has_prev, has_next = database.get_character_page('from', "Conformance B", 1)
+    _check(results, "get_character_page", rows[0][1] == "Conformance Beta" and has_prev and has_next)
+    database.add_character("conformance delta", "images/d.jpg")
+    rows, _, _ = database.get_character_page('from', "C", 10)
+    names = [name for _, name in rows]
+    _check(results, "get_character_page ignores case",
+           names == ["Conformance Alpha", "Conformance Beta", "conformance delta", "Conformance Gamma"] and
+           database.get_character_page('after', rows[1][0], 1)[0][0][1] == "conformance delta" and
+           database.get_character_page('before', rows[3][0], 1)[0][0][1] == "conformance delta")
+    _check(results, "get_first_letters", "C" in database.get_first_letters())
+    _check(results, "get_random_character", database.get_random_character() is not None)
+
+    user = database.get_user(1001)
+    _check(results, "get_user creates missing users", user['coins'] == 0 and user['games_played'] == 0)
+    other = database.get_user(1002)
+    database.apply_user_changes([
+        (1001, _user_change(username="alice", coins=30, strike=2, best_strike=5, total_correct=3, games_played=4)),
+        (1002, _user_change(username="bob", coins=10, best_strike=9, total_correct=1)),
+    ])
+    user.update(username="alice", coins=30, current_strike=2, best_strike=5, total_correct=3, games_played=4)
+    other.update(username="bob", coins=10, best_strike=9, total_correct=1)
+    _check(results, "apply_user_changes round-trip",
+           database.get_user(1001) == user and database.get_user(1002) == other)
+    database.apply_user_changes([(1001, _user_change(coins=5, reset=True, strike=1, games_played=1))])
+    user.update(coins=35, current_strike=1, games_played=5)
+    _check(results, "apply_user_changes adds to stored values", database.get_user(1001) == user)
+    # Another worker creating the user between get_user's read and insert
+    conn = database.get_connection()
+    with conn:
+        conn.execute(database.SQL_INSERT_USER, (1001, ''))
+    _check(results, "creating an existing user is a no-op", database.get_user(1001) == user)
+    _check(results, "get_leaderboard",
+           [r[0] for r in database.get_leaderboard('coins', 10)][:2] == [1001, 1002])
+    _check(results, "get_user_rank", database.get_user_rank('strike', 5) == 2)
+
+    database.add_chat_coins(-1, 1001, 10)
+    database.add_chat_coins(-1, 1001, 10)
+    database.add_chat_coins(-1, 1002, 5)
+    _check(results, "add_chat_coins accumulates",
+           [tuple(r[:3]) for r in database.get_chat_leaderboard(-1, 10)] == [(1001, "alice", 20), (1002, "bob", 5)])
+    _check(results, "get_chat_rank",
+           database.get_chat_rank(-1, 1002) == 2 and database.get_chat_rank(-1, 9999) is None)
+
+    character = {'id': char_id, 'name': "Conformance Alpha"}
+    database.start_game(-1, 1001, character)
+    database.start_game(-1, 1002, character)  # replaces the first
+    _check(results, "start_game / get_all_active_games",
+           [(g['chat_id'], g['user_id']) for g in database.get_all_active_games()] == [(-1, 1002)])
+    restored = database.get_all_active_games()[0]
+    _check(results, "new games have no deadline, a start time",
+           restored['deadline'] is None and abs(restored['started_at'] - time.time()) < 60)
+    database.set_game_deadlines([(-1, 1234567890)])
+    _check(results, "set_game_deadlines",
+           database.get_all_active_games()[0]['deadline'] == 1234567890)
+    database.end_game(-1)
+    _check(results, "end_game", database.get_all_active_games() == [])
+    database.start_game(-2, 1001, character)
+    database.start_game(-3, 1001, character)
+    database.end_games([-2, -3])
+    _check(results, "end_games", database.get_all_active_games() == [])
+
+    gamma_id = inserted[0]['id']
+    database.insert_rounds([
+        (-1, 1001, char_id, 'correct', 4000, 1),
+        (-1, 1001, char_id, 'wrong', 2000, 2),
+        (-1, 1002, gamma_id, 'timeout', 30000, 3),
+    ])
+    database.insert_rounds([(-1, 1001, char_id, 'correct', 3000, 4)])
+    _check(results, "insert_rounds / get_player_round_stats",
+           database.get_player_round_stats(1001) == {'rounds': 3, 'correct': 2, 'wrong': 1, 'timeouts': 0,
+                                                      'solve_ms': 7000, 'fastest_ms': 3000} and
+           database.get_player_round_stats(1002)['fastest_ms'] is None)
+    _check(results, "get_round_totals", database.get_round_totals() == (2, 4, 2, 7000))
+    _check(results, "get_character_stats_by_rate",
+           [r[0] for r in database.get_character_stats_by_rate(True, 1, 10)] ==
+           ["Conformance Gamma", "Conformance Alpha"] and
+           database.get_character_stats_by_rate(False, 2, 10)[0][:3] == ("Conformance Alpha", 3, 2))
+    database.insert_rounds([(-1, 1001, char_id, 'expired', 30000, 5)])
+    _check(results, "expired rounds stay out of the rollups",
+           database.get_player_round_stats(1001)['rounds'] == 3 and
+           database.get_round_totals() == (2, 4, 2, 7000))
+    return results
+
+def bench_storage(args):
+    """Conformance checks, then timings of the per-round storage calls"""
+    results = check_storage()
+    for label, passed in results:
+        print(f"{'✅' if passed else '❌'} {label}")
+    failed = sum(not passed for _, passed in results)
+    print(f"{len(results) - failed}/{len(results)} conformance checks passed on {storage.STORAGE_BACKEND}")
+
+    calls = 2000 if storage.STORAGE_BACKEND == "sqlite" else 500
+    character = database.get_character_records()[0]
+    changes = [(2000 + i, _user_change(coins=10, strike=1, total_correct=1, games_played=1)) for i in range(calls)]
+    for i in range(calls):
+        database.get_user(2000 + i)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        database.get_user(2000 + i)
+    _report("get_user", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for change in changes:
+        database.apply_user_changes([change])
+    _report("apply_user_changes (1/batch)", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, calls, 200):
+        database.apply_user_changes(changes[i:i + 200])
+    _report("apply_user_changes (200/batch)", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        database.start_game(i, 2000 + i, character)
+        database.end_game(i)
+    _report("start_game + end_game", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        database.add_chat_coins(i % 50, 2000 + i, 10)
+    _report("add_chat_coins", calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        database.get_leaderboard('coins', 10)
+    _report("get_leaderboard", calls, time.perf_counter() - start)
+    return failed
+
+def bench_races(args):
+    """Concurrent guesses and timeouts racing for the same rounds
+
+    Every round gets several correct guesses through handle_text_message
+    and its round_timeout at once, from players shared between chats,
+    with a small user cache so records are evicted and reloaded mid-run.
+    Checks that each round is resolved exactly once and that stored
+    stats match what the result messages paid out.
+    """
+    import re
+    import main
+    import games
+    import users
+    import sender
+    import history
+    import scheduler
+    from types import SimpleNamespace
+
+    database.init_db()
+    char_id = database.insert_character("Race Target", "images/race.jpg")
+    character = {'id': char_id, 'name': "Race Target", 'image_path': "images/race.jpg"}
+    chats, rounds, guessers, players = 200, 10, 5, 50
+    users.USER_CACHE_SIZE = 16
+    # Winners' next rounds stay unscheduled until the run is over
+    main.NEXT_ROUND_DELAY = 3600
+    limits = sender.SEND_GLOBAL_RATE, sender.SEND_CHAT_RATE, sender.SEND_GROUP_RATE
+    sender.SEND_GLOBAL_RATE = sender.SEND_CHAT_RATE = sender.SEND_GROUP_RATE = 0
+
+    played = {}
+    results = {}
+    message_ids = itertools.count(1)
+
+    class ResultBot:
+        """Collects the round result messages per chat"""
+
+        async def send_message(self, chat_id, text, **kwargs):
+            results.setdefault(chat_id, []).append(text)
+
+    def guess_update(chat_id, user_id):
+        chat = SimpleNamespace(id=chat_id, type='private')
+        user = SimpleNamespace(id=user_id, username=f"racer{user_id}", first_name="Racer")
+        message = SimpleNamespace(text="Race Target", chat=chat, chat_id=chat_id, message_id=next(message_ids))
+        return SimpleNamespace(message=message, effective_chat=chat, effective_user=user)
+
+    async def pause():
+        # Random yields interleave the racers differently each round
+        for _ in range(random.randint(0, 3)):
+            await asyncio.sleep(0)
+
+    async def guess(chat_id, user_id):
+        await pause()
+        await main.handle_text_message(guess_update(chat_id, user_id), None)
+
+    async def timeout(chat_id, round_id):
+        await pause()
+        await main.round_timeout(chat_id, round_id)
+
+    async def play(chat_id):
+        user_id = chat_id % players
+        for _ in range(rounds):
+            round_id = games.start_game(chat_id, user_id, character)
+            await users.change_user(user_id, games_played=1)
+            played[user_id] = played.get(user_id, 0) + 1
+            racers = [guess(chat_id, user_id) for _ in range(guessers)]
+            racers.append(timeout(chat_id, round_id))
+            random.shuffle(racers)
+            await asyncio.gather(*racers)
+
+    async def run():
+        sender.start_sender(ResultBot())
+        start = time.perf_counter()
+        await asyncio.gather(*(play(chat_id) for chat_id in range(1, chats + 1)))
+        seconds = time.perf_counter() - start
+        scheduler.shutdown_scheduler()
+        await sender.stop_sender()
+        await users.stop_flusher()
+        await history.stop_history()
+        return seconds
+
+    seconds = asyncio.run(run())
+    sender.SEND_GLOBAL_RATE, sender.SEND_CHAT_RATE, sender.SEND_GROUP_RATE = limits
+    total = chats * rounds
+    _report("round resolutions", total * (guessers + 1), seconds)
+
+    failures = []
+    paid = {}
+    correct = {}
+    for chat_id in range(1, chats + 1):
+        texts = results.get(chat_id, [])
+        if len(texts) != rounds:
+            failures.append(f"chat {chat_id}: {len(texts)} results for {rounds} rounds")
+        user_id = chat_id % players
+        for text in texts:
+            coins = re.search(r"\+(\d+) coins!", text)
+            if coins:
+                paid[user_id] = paid.get(user_id, 0) + int(coins.group(1))
+                correct[user_id] = correct.get(user_id, 0) + 1
+    for user_id in played:
+        stored = database.get_user(user_id)
+        logged = database.get_player_round_stats(user_id)
+        if (stored['coins'], stored['total_correct'], stored['games_played']) != (
+            paid.get(user_id, 0), correct.get(user_id, 0), played[user_id]
+        ):
+            failures.append(f"user {user_id}: stored {stored}, paid {paid.get(user_id, 0)} coins "
+                            f"for {correct.get(user_id, 0)} wins in {played[user_id]} rounds")
+        elif logged['rounds'] != played[user_id] or logged['correct'] != correct.get(user_id, 0):
+            failures.append(f"user {user_id}: round log {logged}, expected {played[user_id]} rounds")
+    for failure in failures[:10]:
+        print(f"❌ {failure}")
+    print(f"{'✅' if not failures else '❌'} {total} rounds, {len(played)} players: "
+          f"{len(failures)} invariant violations")
+    return len(failures)
+
+def bench_recovery(args):
+    """Restart recovery: re-arm rounds with time left, end the rest in one pass
+
+    Seeds active_games as a previous process would leave them (saved
+    deadlines ahead and behind, and unsaved ones from a crash), restores
+    them and checks every chat ends up either timed or free.
+    """
+    import games
+    import scheduler
+
+    database.init_db()
+    char_id = database.insert_character("Recovery Target", "images/recovery.jpg")
+    character = {'id': char_id, 'name': "Recovery Target"}
+    chats, time_limit = 3000, 30
+    now = time.time()
+    deadlines = []
+    for chat_id in range(1, chats + 1):
+        database.start_game(chat_id, chat_id, character)
+        if chat_id % 3 == 0:
+            deadlines.append((chat_id, now + time_limit / 2))   # time left
+        elif chat_id % 3 == 1:
+            deadlines.append((chat_id, now - 5))                # ran out while down
+        # chat_id % 3 == 2: crashed before saving, started just now
+
+    database.set_game_deadlines(deadlines)
+    live = {chat_id for chat_id in range(1, chats + 1) if chat_id % 3 != 1}
+    unshown = chats + 1
+
+    async def timeout(chat_id, round_id):
+        pass
+
+    async def run():
+        restored = await database.run_db(games.load_active_games)
+        start = time.perf_counter()
+        expired = games.recover_rounds(time_limit, timeout)
+        seconds = time.perf_counter() - start
+        armed = scheduler.pending()
+        # A round started just before shutdown whose image never went out
+        games.start_game(unshown, unshown, dict(character, image_path="images/recovery.jpg"))
+        await database.run_db(games.save_deadlines)
+        rows = await database.run_db(database.get_all_active_games)
+        scheduler.shutdown_scheduler()
+        return restored, expired, armed, rows, seconds
+
+    restored, expired, armed, rows, seconds = asyncio.run(run())
+    _report("recover_rounds", restored, seconds)
+
+    failures = []
+    if restored != chats:
+        failures.append(f"{restored}/{chats} games restored")
+    if {chat_id for chat_id, _ in expired} != set(range(1, chats + 1)) - live:
+        failures.append(f"{len(expired)} games expired, expected {chats - len(live)}")
+    if armed != len(live):
+        failures.append(f"{armed} timers armed, expected {len(live)}")
+    if {row['chat_id'] for row in rows} != live:
+        failures.append(f"{len(rows)} games left in active_games, expected {len(live)}")
+    if games.get_active_game(unshown) is not None:
+        failures.append("a round nobody saw was kept at shutdown")
+    if any(row['deadline'] is None or row['deadline'] <= now for row in rows):
+        failures.append("a live game was saved without a future deadline")
+    for failure in failures:
+        print(f"❌ {failure}")
+    print(f"{'✅' if not failures else '❌'} {len(live)} rounds re-armed, {len(expired)} expired")
+    return len(failures)
+
+class FakeClock:
+    """Virtual time for sender: sleeps end when run() advances the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []
+        self._sequence = itertools.count()
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self.now + delay, next(self._sequence), future))
+        await future
+
+    async def run(self, done, limit=3600):
+        """Jump to the next sleeper's deadline whenever every task is idle"""
+        while True:
+            for _ in range(20):
+                await asyncio.sleep(0)
+            if done():
+                return
+            while self._sleepers and self._sleepers[0][2].done():
+                heapq.heappop(self._sleepers)
+            if not self._sleepers or self._sleepers[0][0] > limit:
+                raise RuntimeError(f"stalled at t={self.now:.2f}")
+            deadline, _, future = heapq.heappop(self._sleepers)
+            self.now = max(self.now, deadline)
+            future.set_result(None)
+
+class FakeSendBot:
+    """Records (time, chat_id, text) and fails calls from a script"""
+
+    def __init__(self, clock, failures=None):
+        self.clock = clock
+        self.sent = []
+        # text -> exceptions to raise on its first attempts
+        self.failures = failures or {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        errors = self.failures.get(text)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((self.clock.time(), chat_id, text))
+        return text
+
+def check_sender():
+    """Drive the send queue with a fake clock; returns (label, passed) pairs"""
+    import sender
+    from telegram.error import RetryAfter, TimedOut, BadRequest
+
+    results = []
+
+    async def scenario(messages, failures=None):
+        clock = FakeClock()
+        bot = FakeSendBot(clock, failures)
+        sender.start_sender(bot, clock)
+        futures = [sender.send('send_message', chat_id, lane, coalesce, text=text)
+                   for chat_id, lane, coalesce, text in messages]
+        await clock.run(lambda: all(f.done() for f in futures))
+        await sender.stop_sender()
+        return bot.sent, futures
+
+    def run(messages, failures=None):
+        return asyncio.run(scenario(messages, failures))
+
+    # One private chat: a burst of SEND_CHAT_BURST, then one a second
+    sent, _ = run([(1, sender.LOW, None, f"m{i}") for i in range(6)])
+    times = [t for t, _, _ in sent]
+    burst = sender.SEND_CHAT_BURST
+    _check(results, "chat burst, then the chat rate",
+           times[:burst] == [0.0] * burst and
+           all(b - a >= 1 / sender.SEND_CHAT_RATE - 1e-9 for a, b in zip(times[burst - 1:], times[burst:])))
+    _check(results, "chat messages keep their order", [text for _, _, text in sent] == [f"m{i}" for i in range(6)])
+
+    # A group chat is held to 20 a minute
+    sent, _ = run([(-5, sender.LOW, None, f"g{i}") for i in range(burst + 2)])
+    gaps = [b[0] - a[0] for a, b in zip(sent[burst - 1:], sent[burst:])]
+    _check(results, "group chat rate", all(gap >= 1 / sender.SEND_GROUP_RATE - 1e-9 for gap in gaps))
+
+    # Many chats: after a burst of one second's worth, the global rate
+    rate = sender.SEND_GLOBAL_RATE
+    chats = int(rate * 3)
+    sent, _ = run([(chat_id, sender.LOW, None, "x") for chat_id in range(1, chats + 1)])
+    _check(results, "global rate", len(sent) == chats and
+           all(t >= (i + 1 - rate) / rate - 1e-9 for i, (t, _, _) in enumerate(sent)))
+
+    # The HIGH lane goes ahead of LOW messages queued before it
+    messages = [(1, sender.LOW, None, f"info{i}") for i in range(burst + 2)]
+    messages.append((1, sender.HIGH, None, "round"))
+    sent, _ = run(messages)
+    _check(results, "HIGH lane overtakes queued LOW messages",
+           [text for _, _, text in sent][:2] == ["round", "info0"])
+
+    # Queued messages with one coalesce key go out once, with the newest text
+    messages = [(1, sender.LOW, None, f"m{i}") for i in range(burst)]
+    messages += [(1, sender.LOW, 'board', f"board{i}") for i in range(5)]
+    sent, futures = run(messages)
+    _check(results, "coalescing", [text for _, _, text in sent][burst:] == ["board4"] and
+           futures[-1] is futures[burst])
+
+    # RetryAfter pauses the chat and resends
+    sent, futures = run([(1, sender.HIGH, None, "flood"), (1, sender.HIGH, None, "after")],
+                        {"flood": [RetryAfter(5)]})
+    _check(results, "RetryAfter waits, then resends in order",
+           [(t, text) for t, _, text in sent] == [(5.0, "flood"), (5.0, "after")] and futures[0].result() == "flood")
+
+    # Network errors back off exponentially
+    sent, _ = run([(1, sender.HIGH, None, "flaky")], {"flaky": [TimedOut(), TimedOut()]})
+    _check(results, "network errors back off", [t for t, _, _ in sent] == [sender.SEND_BACKOFF * 3])
+
+    # Bad requests fail at once; the caller sees the error
+    sent, futures = run([(1, sender.HIGH, None, "bad")], {"bad": [BadRequest("wrong file id")]})
+    _check(results, "BadRequest is not retried",
+           not sent and isinstance(futures[0].exception(), BadRequest))
+
+    # Giving up after SEND_MAX_ATTEMPTS
+    sent, futures = run([(1, sender.HIGH, None, "down")], {"down": [TimedOut()] * sender.SEND_MAX_ATTEMPTS})
+    _check(results, "retries are bounded", not sent and isinstance(futures[0].exception(), TimedOut))
+    return results
+
+def bench_sender(args):
+    """Send queue behaviour under a fake clock, then its per-message overhead"""
+    import sender
+
+    results = check_sender()
+    for label, passed in results:
+        print(f"{'✅' if passed else '❌'} {label}")
+    failed = sum(not passed for _, passed in results)
+    print(f"{len(results) - failed}/{len(results)} send queue checks passed")
+
+    class NullBot:
+        async def send_message(self, chat_id, text, **kwargs):
+            return text
+
+    async def run(calls):
+        rates = sender.SEND_GLOBAL_RATE, sender.SEND_CHAT_RATE
+        sender.SEND_GLOBAL_RATE = sender.SEND_CHAT_RATE = 0
+        sender.start_sender(NullBot())
+        start = time.perf_counter()
+        futures = [sender.send('send_message', i % 1000 + 1, text="x") for i in range(calls)]
+        await asyncio.gather(*futures)
+        seconds = time.perf_counter() - start
+        await sender.stop_sender()
+        sender.SEND_GLOBAL_RATE, sender.SEND_CHAT_RATE = rates
+        return seconds
+
+    calls = 50000
+    _report("send (unlimited, 1000 chats)", calls, asyncio.run(run(calls)))
+    return failed
+
+def bench_startup(args):
+    """Cold-start cost: importing main, then migrating and re-checking the schema
+
+    Fails when importing main takes longer than --import-budget-ms, touches
+    the database or loads a module that should be deferred.
+    """
+    directory = tempfile.mkdtemp(prefix="nguess-startup-")
+    probe = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))\n"
+    )
+    env = dict(os.environ, DB_PATH=os.path.join(directory, "startup.db"), LOG_LEVEL="WARNING")
+    repo = os.path.dirname(os.path.abspath(__file__))
+
+    # Best of a few fresh interpreters, so one slow run does not fail CI
+    times = []
+    for _ in range(3):
+        output = subprocess.run(
+            [sys.executable, "-c", probe], cwd=repo, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+        times.append(float(output[0]) * 1000)
+    loaded = [name for name in output[1].split(',') if name]
+    print(f"import main: best {min(times):.0f} ms, worst {max(times):.0f} ms "
+          f"(budget {args.import_budget_ms:.0f} ms)")
+
+    failures = []
+    if min(times) > args.import_budget_ms:
+        failures.append(f"import main took {min(times):.0f} ms")
+    if os.path.exists(env['DB_PATH']):
+        failures.append("import main opened the database")
+    if loaded:
+        failures.append(f"import main loaded deferred modules: {', '.join(loaded)}")
+
+    database.close_connection()
+    saved_path, database.DB_PATH = database.DB_PATH, env['DB_PATH']
+    try:
+        start = time.perf_counter()
+        applied = database.init_db()
+        print(f"init_db (new database, {applied} migrations): {(time.perf_counter() - start) * 1000:.1f} ms")
+        start = time.perf_counter()
+        applied = database.init_db()
+        print(f"init_db (current schema): {(time.perf_counter() - start) * 1000:.2f} ms")
+        if applied or database.get_schema_version() != database.SCHEMA_VERSION:
+            failures.append("init_db re-applied migrations on a current schema")
+    finally:
+        database.close_connection()
+        database.DB_PATH = saved_path
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    print(f"{'✅' if not failures else '❌'} startup checks")
+    return len(failures)
+
+def _use_database(path, stand_in):
+    """Point every connection at a new database so no benchmark sees another's rows"""
+    database._executor.submit(database.close_connection).result()
+    database.close_connection()
+    database.DB_PATH = path
+    if stand_in:
+        _, storage.RQLITE_URL = serve_in_thread(path)
+        print(f"Using a local rqlite stand-in at {storage.RQLITE_URL}")
+
+BENCHMARKS = {
+    'sampler': bench_sampler,
+    'matching': bench_matching,
+    'storage': bench_storage,
+    'races': bench_races,
+    'recovery': bench_recovery,
+    'sender': bench_sender,
+    'startup': bench_startup,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"one of {', '.join(sorted(BENCHMARKS))} (default: all)")
+    parser.add_argument('--size', type=int, default=100000, help="roster size")
+    parser.add_argument('--backend', default=storage.STORAGE_BACKEND, choices=('sqlite', 'rqlite'),
+                        help="storage backend (default: STORAGE_BACKEND)")
+    parser.add_argument('--import-budget-ms', type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1000")),
+                        help="startup: fail if importing main takes longer")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    args.benchmarks = args.benchmarks or sorted(BENCHMARKS)
+
+    storage.STORAGE_BACKEND = args.backend
+    stand_in = args.backend == "rqlite" and not os.getenv("RQLITE_URL")
+    directory = os.path.dirname(database.DB_PATH)
+
+    failed = 0
+    for name in args.benchmarks:
+        print(f"\n=== {name} ===")
+        _use_database(os.path.join(directory, f"{name}.db"), stand_in)
+        failed += BENCHMARKS[name](args) or 0
+    database.shutdown_db()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
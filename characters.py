@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+import os
+import random
+from collections import deque
+import database
+from matching import build_index
+
+# Rounds a chat must wait before seeing the same character again
+RECENT_WINDOW = int(os.getenv("RECENT_WINDOW", "10"))
+# Redraws allowed when a pick falls inside the recent window
+MAX_REDRAWS = 16
+
+# Adaptive difficulty (override with env vars): characters are bucketed by
+# solve rate and players are served from the bucket their strike earns
+ADAPTIVE_DIFFICULTY = os.getenv("ADAPTIVE_DIFFICULTY", "1") == "1"
+EASY_SOLVE_RATE = float(os.getenv("EASY_SOLVE_RATE", "0.7"))   # at or above: easy
+HARD_SOLVE_RATE = float(os.getenv("HARD_SOLVE_RATE", "0.4"))   # below: hard
+# Rounds a character needs before it leaves the medium bucket
+MIN_RATED_ROUNDS = int(os.getenv("MIN_RATED_ROUNDS", "5"))
+# Current strikes from which players get medium, then hard characters
+MEDIUM_STRIKE = int(os.getenv("MEDIUM_STRIKE", "5"))
+HARD_STRIKE = int(os.getenv("HARD_STRIKE", "15"))
+# Current strike from which rounds show a rendered crop, blur or
+# silhouette of the image instead of the original (0 = never)
+VARIANT_STRIKE = int(os.getenv("VARIANT_STRIKE", "25"))
+
+EASY, MEDIUM, HARD = 0, 1, 2
+# Target bucket -> buckets to try, nearest first (easier on ties)
+_FALLBACK = {
+    target: sorted((EASY, MEDIUM, HARD), key=lambda bucket: (abs(bucket - target), bucket))
+    for target in (EASY, MEDIUM, HARD)
+}
+
+# Character records in insertion order; _tree is a Fenwick tree over
+# their weights (1-indexed) so weighted picks and appends are O(log n)
+_characters = []
+_tree = [0.0]
+_total_weight = 0.0
+_weighted = False
+
+# chat_id -> (deque of recent ids, set of the same ids)
+_recent = {}
+
+# id -> record, for file_id updates
+_by_id = {}
+# (id, variant) -> file_id of an uploaded difficulty variant. Kept in
+# memory only, so each variant is uploaded once per process
+_variant_file_ids = {}
+# Difficulty -> records; record['slot'] is its index there, so moving a
+# record between buckets is a swap-remove and an append. Each bucket has
+# a Fenwick tree and total over its members' weights, so weights apply
+# within the bucket a strike draws from
+_buckets = ([], [], [])
+_bucket_trees = ([0.0], [0.0], [0.0])
+_bucket_weights = [0.0, 0.0, 0.0]
+
+# =============== LOADING ===============
+async def load_characters():
+    """Load the roster into the sampler"""
+    records = await database.run_db(database.get_character_records)
+    _characters.clear()
+    _by_id.clear()
+    for bucket in (EASY, MEDIUM, HARD):
+        _buckets[bucket].clear()
+        del _bucket_trees[bucket][1:]
+        _bucket_weights[bucket] = 0.0
+    del _tree[1:]
+    global _total_weight, _weighted
+    _total_weight = 0.0
+    _weighted = False
+    for record in records:
+        _append(record)
+    return len(_characters)
+
+async def add_character(name, image_path, file_id=None, image_hash=None):
+    """Add a new character to database and to the sampler"""
+    char_id = await database.run_db(
+        database.insert_character, name, image_path, file_id, image_hash
+    )
+    if char_id is None:
+        return False
+    _append({
+        'id': char_id,
+        'name': name,
+        'image_path': image_path,
+        'weight': 1.0,
+        'file_id': file_id,
+        'image_hash': image_hash
+    })
+    return True
+
+async def load_new_characters():
+    """Append characters other processes have added since the last load"""
+    last_id = max(_by_id, default=0)
+    records = await database.run_db(database.get_character_records, last_id)
+    add_records(records)
+    return len(records)
+
+def add_records(records):
+    """Add already-inserted character records to the sampler"""
+    for record in records:
+        _append(record)
+
+def set_file_id(char_id, file_id, variant=None):
+    """Cache Telegram's file_id for a character or one of its variants (None forces a re-upload)"""
+    if variant is not None:
+        if file_id is None:
+            _variant_file_ids.pop((char_id, variant), None)
+        else:
+            _variant_file_ids[(char_id, variant)] = file_id
+        return
+    record = _by_id.get(char_id)
+    if record is None or record.get('file_id') == file_id:
+        return
+    record['file_id'] = file_id
+    database.submit_db(database.set_character_file_id, char_id, file_id)
+
+def variant_file_id(char_id, variant):
+    """file_id of a character's variant, if this process has uploaded it"""
+    return _variant_file_ids.get((char_id, variant))
+
+def record_result(char_id, solved):
+    """Count a finished round for a character, re-bucketing it if needed (no I/O)"""
+    record = _by_id.get(char_id)
+    if record is None:
+        return
+    record['rounds'] += 1
+    record['correct'] += bool(solved)
+    _place(record)
+
+def difficulty(record):
+    """EASY, MEDIUM or HARD from a record's solve rate"""
+    if record['rounds'] < MIN_RATED_ROUNDS:
+        return MEDIUM
+    rate = record['correct'] / record['rounds']
+    if rate >= EASY_SOLVE_RATE:
+        return EASY
+    if rate < HARD_SOLVE_RATE:
+        return HARD
+    return MEDIUM
+
+def _place(record):
+    """Put a record in the bucket its solve rate calls for"""
+    bucket = difficulty(record)
+    old = record.get('bucket')
+    if old == bucket:
+        return
+    if old is not None:
+        members = _buckets[old]
+        tree = _bucket_trees[old]
+        last = members.pop()
+        if last is not record:
+            members[record['slot']] = last
+            last['slot'] = record['slot']
+            _tree_add(tree, record['slot'] + 1, last['weight'] - record['weight'])
+        # No other node sums the last position, so it just drops off
+        tree.pop()
+        # A running float sum can leave a remainder once the bucket empties
+        _bucket_weights[old] = _bucket_weights[old] - record['weight'] if members else 0.0
+    record['bucket'] = bucket
+    record['slot'] = len(_buckets[bucket])
+    _buckets[bucket].append(record)
+    _tree_append(_bucket_trees[bucket], record['weight'])
+    _bucket_weights[bucket] += record['weight']
+
+def character_count():
+    """Number of characters in the roster (no I/O)"""
+    return len(_characters)
+
+def has_character(char_id):
+    """Whether an id belongs to the roster (no I/O)"""
+    return char_id in _by_id
+
+def _append(record):
+    """Append a record and its weight to the Fenwick trees"""
+    global _total_weight, _weighted
+    weight = record['weight'] = max(float(record.get('weight', 1.0)), 0.0)
+    record['match'] = build_index(record['name'])
+    record.setdefault('rounds', 0)
+    record.setdefault('correct', 0)
+    _characters.append(record)
+    _by_id[record['id']] = record
+    _place(record)
+    _tree_append(_tree, weight)
+    _total_weight += weight
+    if weight != 1.0:
+        _weighted = True
+
+# =============== FENWICK TREES ===============
+def _tree_append(tree, weight):
+    """Append one weight to a Fenwick tree"""
+    index = len(tree)
+    # A new node covers (index - lowbit, index]; all but the new element
+    # are already summed in the nodes below it
+    node = weight
+    child = index - 1
+    stop = index - (index & -index)
+    while child > stop:
+        node += tree[child]
+        child -= child & -child
+    tree.append(node)
+
+def _tree_add(tree, index, delta):
+    """Add delta to the weight at a 1-based index"""
+    while index < len(tree):
+        tree[index] += delta
+        index += index & -index
+
+def _find(tree, target):
+    """0-based position of the element whose weight range contains target"""
+    position = 0
+    step = 1 << (len(tree) - 1).bit_length()
+    while step:
+        next_position = position + step
+        if next_position < len(tree) and tree[next_position] <= target:
+            position = next_position
+            target -= tree[next_position]
+        step >>= 1
+    return min(position, len(tree) - 2)
+
+# =============== SAMPLING ===============
+def _pick(strike=None):
+    """Draw one record from the strike's difficulty bucket, by weight within it"""
+    if strike is not None and ADAPTIVE_DIFFICULTY:
+        target = HARD if strike >= HARD_STRIKE else MEDIUM if strike >= MEDIUM_STRIKE else EASY
+        for bucket in _FALLBACK[target]:
+            members = _buckets[bucket]
+            if not _weighted:
+                if members:
+                    return random.choice(members)
+            elif members and _bucket_weights[bucket] > 0:
+                # A bucket of zero-weight characters counts as empty
+                return members[_find(_bucket_trees[bucket], random.random() * _bucket_weights[bucket])]
+    if _weighted:
+        return _characters[_find(_tree, random.random() * _total_weight)]
+    return random.choice(_characters)
+
+def get_random_character(chat_id=None, strike=None):
+    """Get a random character, avoiding the chat's recent ones (no I/O)
+
+    With a player's current strike, the character comes from the
+    difficulty bucket that strike earns (see ADAPTIVE_DIFFICULTY).
+    """
+    if not _characters:
+        return None
+
+    recent = _recent.get(chat_id) if chat_id is not None else None
+    character = _pick(strike)
+    if recent is not None and len(_characters) > 1:
+        recent_ids, recent_set = recent
+        # With a small roster only avoid an immediate repeat
+        if len(_characters) <= RECENT_WINDOW:
+            recent_set = {recent_ids[-1]} if recent_ids else set()
+        for _ in range(MAX_REDRAWS):
+            if character['id'] not in recent_set:
+                break
+            character = _pick(strike)
+
+    if chat_id is not None and RECENT_WINDOW > 0:
+        _remember(chat_id, character['id'])
+
+    return {
+        'id': character['id'],
+        'name': character['name'],
+        'image_path': character['image_path'],
+        'file_id': character.get('file_id'),
+        'image_hash': character.get('image_hash'),
+        'match': character['match']
+    }
+
+def _remember(chat_id, char_id):
+    """Record a pick in the chat's no-repeat window"""
+    recent = _recent.get(chat_id)
+    if recent is None:
+        recent = _recent[chat_id] = (deque(), set())
+    recent_ids, recent_set = recent
+    recent_ids.append(char_id)
+    recent_set.add(char_id)
+    if len(recent_ids) > RECENT_WINDOW:
+        old_id = recent_ids.popleft()
+        if old_id not in recent_ids:
+            recent_set.discard(old_id)
@@ -0,0 +1,723 @@
+#!/usr/bin/env python3
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import storage
+from metrics import observe
+
+logger = logging.getLogger(__name__)
+
+# Database location for the sqlite backend (override with DB_PATH env var);
+# STORAGE_BACKEND picks the backend, see storage.py
+DB_PATH = os.getenv("DB_PATH", "anime_bot.db")
+
+# One long-lived connection per thread
+_local = threading.local()
+
+# Single worker thread that owns all DB work issued from async handlers,
+# so writes are serialized and never block the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# =============== CONNECTIONS ===============
+def get_connection():
+    """Get this thread's connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = storage.connect(DB_PATH)
+    return conn
+
+def close_connection():
+    """Close this thread's connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# =============== ASYNC API ===============
+def _timed(func, *args):
+    """Run a DB function, recording its time on the DB thread (queueing excluded)"""
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        observe('db_seconds', time.perf_counter() - start, function=func.__name__)
+
+async def run_db(func, *args):
+    """Run a blocking DB function on the DB thread and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, func, *args)
+
+def submit_db(func, *args):
+    """Queue a DB function on the DB thread without waiting for it"""
+    future = _executor.submit(_timed, func, *args)
+    future.add_done_callback(_log_db_error)
+    return future
+
+def _log_db_error(future):
+    """Report failures of fire-and-forget DB work"""
+    error = future.exception()
+    if error is not None:
+        logger.error("background DB write failed: %s", error)
+
+def shutdown_db():
+    """Finish queued DB work and close the DB thread's connection"""
+    _executor.submit(close_connection).result()
+    _executor.shutdown(wait=True)
+
+# =============== SQL STATEMENTS ===============
+# Kept as constants so sqlite3's per-connection statement cache reuses
+# the prepared statement instead of re-parsing the SQL on every call.
+# All SQL is SQLite's dialect, which every storage backend speaks.
+SQL_INSERT_CHARACTER = '''
+    INSERT INTO characters (name, image_path, file_id, image_hash) VALUES (?, ?, ?, ?)
+'''
+SQL_IMPORT_CHARACTER = '''
+    INSERT OR IGNORE INTO characters (name, image_path, image_hash) VALUES (?, ?, ?)
+'''
+SQL_IMAGE_REFS = 'SELECT id, image_path, image_hash FROM characters'
+SQL_SET_CHARACTER_IMAGE = 'UPDATE characters SET image_path = ?, image_hash = ? WHERE id = ?'
+SQL_CHARACTER_HASHES = 'SELECT image_hash FROM characters WHERE image_hash IS NOT NULL'
+SQL_SET_FILE_ID = 'UPDATE characters SET file_id = ? WHERE id = ?'
+SQL_RANDOM_CHARACTER = 'SELECT id, name, image_path FROM characters ORDER BY RANDOM() LIMIT 1'
+# Records carry their round rollup so the sampler can bucket by difficulty
+SQL_ALL_CHARACTER_RECORDS = '''
+    SELECT c.id, c.name, c.image_path, c.weight, c.file_id, c.image_hash,
+           COALESCE(s.rounds, 0), COALESCE(s.correct, 0)
+    FROM characters c
+    LEFT JOIN character_stats s ON s.character_id = c.id
+'''
+SQL_CHARACTER_RECORDS_AFTER = '''
+    SELECT c.id, c.name, c.image_path, c.weight, c.file_id, c.image_hash,
+           COALESCE(s.rounds, 0), COALESCE(s.correct, 0)
+    FROM characters c
+    LEFT JOIN character_stats s ON s.character_id = c.id
+    WHERE c.id > ? ORDER BY c.id
+'''
+SQL_ALL_CHARACTER_NAMES = 'SELECT name FROM characters ORDER BY name'
+SQL_SELECT_USER = '''
+    SELECT user_id, username, coins, current_strike, best_strike,
+           total_correct, games_played
+    FROM users WHERE user_id = ?
+'''
+# Another worker or replica may create the same user first
+SQL_INSERT_USER = 'INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)'
+# Relative update: every stat is changed from its stored value, so
+# changes from concurrent handlers or processes never overwrite each other.
+# In SET, current_strike still reads the old value.
+SQL_CHANGE_USER = '''
+    UPDATE users SET
+        username = COALESCE(?, username),
+        coins = coins + ?,
+        current_strike = (CASE WHEN ? THEN 0 ELSE current_strike END) + ?,
+        best_strike = MAX(best_strike, ?, (CASE WHEN ? THEN 0 ELSE current_strike END) + ?),
+        total_correct = total_correct + ?,
+        games_played = games_played + ?,
+        last_played = CURRENT_TIMESTAMP
+    WHERE user_id = ?
+'''
+SQL_DELETE_GAME = 'DELETE FROM active_games WHERE chat_id = ?'
+SQL_INSERT_GAME = '''
+    INSERT INTO active_games (chat_id, user_id, character_id, character_name)
+    VALUES (?, ?, ?, ?)
+'''
+SQL_ALL_GAMES = '''
+    SELECT ag.chat_id, ag.character_name, ag.user_id, ag.character_id, c.image_path,
+           ag.deadline, CAST(strftime('%s', ag.start_time) AS INTEGER)
+    FROM active_games ag
+    JOIN characters c ON ag.character_id = c.id
+'''
+SQL_SET_DEADLINE = 'UPDATE active_games SET deadline = ? WHERE chat_id = ?'
+# Leaderboard sort modes -> users column (all indexed)
+LEADERBOARD_COLUMNS = {
+    'coins': 'coins',
+    'strike': 'best_strike',
+    'correct': 'total_correct'
+}
+SQL_LEADERBOARD = {
+    mode: f'''
+        SELECT user_id, username, coins, best_strike, total_correct
+        FROM users
+        WHERE {column} > 0
+        ORDER BY {column} DESC
+        LIMIT ?
+    '''
+    for mode, column in LEADERBOARD_COLUMNS.items()
+}
+SQL_USER_RANK = {
+    mode: f'SELECT COUNT(*) FROM users WHERE {column} > ?'
+    for mode, column in LEADERBOARD_COLUMNS.items()
+}
+SQL_ADD_CHAT_COINS = '''
+    INSERT INTO chat_scores (chat_id, user_id, coins) VALUES (?, ?, ?)
+    ON CONFLICT (chat_id, user_id) DO UPDATE SET coins = coins + excluded.coins
+'''
+SQL_CHAT_LEADERBOARD = '''
+    SELECT cs.user_id, u.username, cs.coins, u.best_strike, u.total_correct
+    FROM chat_scores cs
+    JOIN users u ON u.user_id = cs.user_id
+    WHERE cs.chat_id = ? AND cs.coins > 0
+    ORDER BY cs.coins DESC
+    LIMIT ?
+'''
+SQL_CHAT_RANK = '''
+    SELECT COUNT(*) FROM chat_scores
+    WHERE chat_id = ? AND coins > (
+        SELECT coins FROM chat_scores WHERE chat_id = ? AND user_id = ?
+    )
+'''
+SQL_CHAT_USER_EXISTS = 'SELECT 1 FROM chat_scores WHERE chat_id = ? AND user_id = ? AND coins > 0'
+# Keyset pagination over the UNIQUE(name) index; cursors are character ids
+# /slist pages run in (name COLLATE NOCASE, name) order, so names group by
+# letter whatever their case; the plain name breaks ties between names
+# differing only in case. Every keyset condition starts with a NOCASE
+# range so it seeks idx_characters_name_nocase.
+SQL_PAGE_FIRST = 'SELECT id, name FROM characters ORDER BY name COLLATE NOCASE, name LIMIT ?'
+SQL_PAGE_AFTER = '''
+    WITH cursor AS (SELECT name FROM characters WHERE id = ?)
+    SELECT c.id, c.name FROM characters c, cursor
+    WHERE c.name COLLATE NOCASE >= cursor.name
+      AND (c.name COLLATE NOCASE > cursor.name OR c.name > cursor.name)
+    ORDER BY c.name COLLATE NOCASE, c.name LIMIT ?
+'''
+SQL_PAGE_BEFORE = '''
+    WITH cursor AS (SELECT name FROM characters WHERE id = ?)
+    SELECT c.id, c.name FROM characters c, cursor
+    WHERE c.name COLLATE NOCASE <= cursor.name
+      AND (c.name COLLATE NOCASE < cursor.name OR c.name < cursor.name)
+    ORDER BY c.name COLLATE NOCASE DESC, c.name DESC LIMIT ?
+'''
+SQL_PAGE_FROM = '''
+    SELECT id, name FROM characters
+    WHERE name COLLATE NOCASE >= ?
+    ORDER BY name COLLATE NOCASE, name LIMIT ?
+'''
+SQL_NAME_BEFORE_EXISTS = '''
+    SELECT 1 FROM characters
+    WHERE name COLLATE NOCASE <= ? AND (name COLLATE NOCASE < ? OR name < ?) LIMIT 1
+'''
+SQL_NAME_AFTER_EXISTS = '''
+    SELECT 1 FROM characters
+    WHERE name COLLATE NOCASE >= ? AND (name COLLATE NOCASE > ? OR name > ?) LIMIT 1
+'''
+SQL_FIRST_LETTERS = 'SELECT DISTINCT upper(substr(name, 1, 1)) FROM characters ORDER BY 1'
+SQL_INSERT_ROUND = '''
+    INSERT INTO rounds (chat_id, user_id, character_id, outcome, response_ms, ended_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+# Rollups: one upsert per character or player per batch, adding its totals.
+# fastest_ms is NULL until a first correct answer.
+ROLLUP_COLUMNS = ('rounds', 'correct', 'wrong', 'timeouts', 'solve_ms', 'fastest_ms')
+SQL_ADD_ROUND_STATS = {
+    table: f'''
+        INSERT INTO {table} ({key}, rounds, correct, wrong, timeouts, solve_ms, fastest_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT ({key}) DO UPDATE SET
+            rounds = rounds + excluded.rounds,
+            correct = correct + excluded.correct,
+            wrong = wrong + excluded.wrong,
+            timeouts = timeouts + excluded.timeouts,
+            solve_ms = solve_ms + excluded.solve_ms,
+            fastest_ms = MIN(COALESCE(fastest_ms, excluded.fastest_ms),
+                             COALESCE(excluded.fastest_ms, fastest_ms))
+    '''
+    for table, key in (('character_stats', 'character_id'), ('player_stats', 'user_id'))
+}
+SQL_PLAYER_STATS = '''
+    SELECT rounds, correct, wrong, timeouts, solve_ms, fastest_ms
+    FROM player_stats WHERE user_id = ?
+'''
+SQL_ROUND_TOTALS = 'SELECT COUNT(*), SUM(rounds), SUM(correct), SUM(solve_ms) FROM character_stats'
+# Characters by solve rate among those with enough rounds to judge
+SQL_CHARACTER_STATS_BY_RATE = {
+    order: f'''
+        SELECT c.name, s.rounds, s.correct, s.solve_ms, s.fastest_ms
+        FROM character_stats s
+        JOIN characters c ON c.id = s.character_id
+        WHERE s.rounds >= ?
+        ORDER BY CAST(s.correct AS REAL) / s.rounds {order}, s.rounds DESC
+        LIMIT ?
+    '''
+    for order in ('ASC', 'DESC')
+}
+
+# =============== DATABASE SETUP ===============
+# Applied schema versions; one row per migration
+SQL_CREATE_SCHEMA_VERSION = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+SQL_SCHEMA_VERSION = 'SELECT MAX(version) FROM schema_version'
+SQL_RECORD_VERSION = 'INSERT OR IGNORE INTO schema_version (version) VALUES (?)'
+
+def _migrate_tables(conn):
+    """1: base tables and the columns added after the first release"""
+    # Characters table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS characters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            image_path TEXT NOT NULL,
+            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Users table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            coins INTEGER DEFAULT 0,
+            current_strike INTEGER DEFAULT 0,
+            best_strike INTEGER DEFAULT 0,
+            total_correct INTEGER DEFAULT 0,
+            games_played INTEGER DEFAULT 0,
+            last_played TIMESTAMP
+        )
+    ''')
+
+    # Active games table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_games (
+            chat_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            character_id INTEGER NOT NULL,
+            character_name TEXT NOT NULL,
+            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (character_id) REFERENCES characters (id)
+        )
+    ''')
+
+    # Per-chat coin totals
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_scores (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            coins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        )
+    ''')
+
+    _add_column(conn, 'characters', 'weight', 'REAL NOT NULL DEFAULT 1.0')
+    _add_column(conn, 'characters', 'file_id', 'TEXT')
+    _add_column(conn, 'characters', 'image_hash', 'TEXT')
+
+def _migrate_indexes(conn):
+    """2: indexes behind the leaderboard, rank, image GC and /slist letter queries"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_coins ON users (coins)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_best_strike ON users (best_strike)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_total_correct ON users (total_correct)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_scores_coins ON chat_scores (chat_id, coins)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_characters_image_hash ON characters (image_hash)')
+    # Same expression as SQL_FIRST_LETTERS, so the letter row of /slist
+    # reads the index instead of sorting every name
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_characters_first_letter ON characters (upper(substr(name, 1, 1)))'
+    )
+
+def _migrate_rounds(conn):
+    """3: append-only round log and its incrementally maintained rollups"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rounds (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            character_id INTEGER NOT NULL,
+            outcome TEXT NOT NULL,
+            response_ms INTEGER NOT NULL,
+            ended_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS character_stats (
+            character_id INTEGER PRIMARY KEY,
+            rounds INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            wrong INTEGER NOT NULL DEFAULT 0,
+            timeouts INTEGER NOT NULL DEFAULT 0,
+            solve_ms INTEGER NOT NULL DEFAULT 0,
+            fastest_ms INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS player_stats (
+            user_id INTEGER PRIMARY KEY,
+            rounds INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            wrong INTEGER NOT NULL DEFAULT 0,
+            timeouts INTEGER NOT NULL DEFAULT 0,
+            solve_ms INTEGER NOT NULL DEFAULT 0,
+            fastest_ms INTEGER
+        )
+    ''')
+
+def _migrate_deadlines(conn):
+    """4: round deadlines, saved at shutdown so a restart can re-arm timers"""
+    # Unix time; NULL until saved (start_time + the time limit is the fallback)
+    _add_column(conn, 'active_games', 'deadline', 'INTEGER')
+
+def _migrate_name_nocase(conn):
+    """5: index behind the case-insensitive /slist page order"""
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_characters_name_nocase ON characters (name COLLATE NOCASE, name)'
+    )
+
+# (version, migration) in order. Migrations are idempotent so databases
+# created before versioning upgrade cleanly; append new ones, never edit.
+MIGRATIONS = [
+    (1, _migrate_tables),
+    (2, _migrate_indexes),
+    (3, _migrate_rounds),
+    (4, _migrate_deadlines),
+    (5, _migrate_name_nocase),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version():
+    """Highest applied migration, 0 for a new or pre-versioning database"""
+    try:
+        version = get_connection().execute(SQL_SCHEMA_VERSION).fetchone()[0]
+    except sqlite3.OperationalError:
+        # No schema_version table yet
+        return 0
+    return version or 0
+
+def init_db():
+    """Apply pending migrations; a single query when the schema is current
+
+    Returns the number of migrations applied.
+    """
+    version = get_schema_version()
+    if version >= SCHEMA_VERSION:
+        return 0
+
+    conn = get_connection()
+    pending = [(v, migration) for v, migration in MIGRATIONS if v > version]
+    with conn:
+        conn.execute(SQL_CREATE_SCHEMA_VERSION)
+    for v, migration in pending:
+        with conn:
+            migration(conn)
+            conn.execute(SQL_RECORD_VERSION, (v,))
+        logger.info("schema migrated to version %s", v)
+    return len(pending)
+
+def _add_column(conn, table, column, declaration):
+    """Add a column to an existing table if it is missing"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+# =============== DATABASE FUNCTIONS ===============
+def add_character(name, image_path, file_id=None, image_hash=None):
+    """Add a new character to database"""
+    return insert_character(name, image_path, file_id, image_hash) is not None
+
+def insert_character(name, image_path, file_id=None, image_hash=None):
+    """Insert a character and return its id (None if the name exists)"""
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute(SQL_INSERT_CHARACTER, (name, image_path, file_id, image_hash))
+        return cursor.lastrowid
+    except sqlite3.IntegrityError:
+        return None
+
+def get_random_character():
+    """Get a random character from database"""
+    result = get_connection().execute(SQL_RANDOM_CHARACTER).fetchone()
+
+    if result:
+        return {
+            'id': result[0],
+            'name': result[1],
+            'image_path': result[2]
+        }
+    return None
+
+def insert_characters(rows):
+    """Insert (name, image_path, image_hash) rows in one transaction
+
+    Returns records for the rows actually inserted; names that already
+    exist are skipped.
+    """
+    conn = get_connection()
+    with conn:
+        cursors = [conn.execute(SQL_IMPORT_CHARACTER, row) for row in rows]
+    # Cursors are read after the commit: batched backends fill them in then
+    return [
+        {
+            'id': cursor.lastrowid,
+            'name': name,
+            'image_path': image_path,
+            'weight': 1.0,
+            'file_id': None,
+            'image_hash': image_hash
+        }
+        for (name, image_path, image_hash), cursor in zip(rows, cursors)
+        if cursor.rowcount
+    ]
+
+def get_character_hashes():
+    """Image hashes of every character that has one"""
+    return {r[0] for r in get_connection().execute(SQL_CHARACTER_HASHES).fetchall()}
+
+def get_image_refs():
+    """(id, image_path, image_hash) of every character"""
+    return get_connection().execute(SQL_IMAGE_REFS).fetchall()
+
+def set_character_image(char_id, image_path, image_hash):
+    """Point a character at a stored image"""
+    conn = get_connection()
+    with conn:
+        conn.execute(SQL_SET_CHARACTER_IMAGE, (image_path, image_hash, char_id))
+
+def get_character_records(after_id=None):
+    """Get id, name, image path and hash, weight and round counts of every character (or those after an id)"""
+    if after_id is None:
+        results = get_connection().execute(SQL_ALL_CHARACTER_RECORDS).fetchall()
+    else:
+        results = get_connection().execute(SQL_CHARACTER_RECORDS_AFTER, (after_id,)).fetchall()
+    return [
+        {
+            'id': r[0],
+            'name': r[1],
+            'image_path': r[2],
+            'weight': r[3],
+            'file_id': r[4],
+            'image_hash': r[5],
+            'rounds': r[6],
+            'correct': r[7]
+        }
+        for r in results
+    ]
+
+def get_character_page(direction, cursor, limit):
+    """One keyset page of (id, name) rows plus whether pages exist before/after it
+
+    direction is 'first', 'after' / 'before' (cursor is a character id)
+    or 'from' (cursor is a name prefix).
+    """
+    conn = get_connection()
+    if direction == 'first':
+        rows = conn.execute(SQL_PAGE_FIRST, (limit,)).fetchall()
+    elif direction == 'after':
+        rows = conn.execute(SQL_PAGE_AFTER, (cursor, limit)).fetchall()
+    elif direction == 'before':
+        rows = conn.execute(SQL_PAGE_BEFORE, (cursor, limit)).fetchall()[::-1]
+    else:
+        rows = conn.execute(SQL_PAGE_FROM, (cursor, limit)).fetchall()
+
+    if not rows:
+        return [], False, False
+    first, last = rows[0][1], rows[-1][1]
+    has_prev = conn.execute(SQL_NAME_BEFORE_EXISTS, (first, first, first)).fetchone() is not None
+    has_next = conn.execute(SQL_NAME_AFTER_EXISTS, (last, last, last)).fetchone() is not None
+    return rows, has_prev, has_next
+
+def get_first_letters():
+    """Distinct upper-cased first letters of character names"""
+    return [r[0] for r in get_connection().execute(SQL_FIRST_LETTERS).fetchall()]
+
+def set_character_file_id(char_id, file_id):
+    """Remember Telegram's file_id for a character image (None clears it)"""
+    conn = get_connection()
+    with conn:
+        conn.execute(SQL_SET_FILE_ID, (file_id, char_id))
+
+def get_all_characters():
+    """Get all characters"""
+    results = get_connection().execute(SQL_ALL_CHARACTER_NAMES).fetchall()
+    return [r[0] for r in results]
+
+def get_user(user_id):
+    """Get or create user"""
+    conn = get_connection()
+    user = conn.execute(SQL_SELECT_USER, (user_id,)).fetchone()
+
+    if not user:
+        with conn:
+            inserted = conn.execute(SQL_INSERT_USER, (user_id, '')).rowcount
+        if inserted == 0:
+            # Lost the race: return the row the other writer created
+            user = conn.execute(SQL_SELECT_USER, (user_id,)).fetchone()
+
+    if not user:
+        return {
+            'user_id': user_id,
+            'username': '',
+            'coins': 0,
+            'current_strike': 0,
+            'best_strike': 0,
+            'total_correct': 0,
+            'games_played': 0
+        }
+
+    return {
+        'user_id': user[0],
+        'username': user[1] or '',
+        'coins': user[2],
+        'current_strike': user[3],
+        'best_strike': user[4],
+        'total_correct': user[5],
+        'games_played': user[6] or 0
+    }
+
+def apply_user_changes(changes):
+    """Apply (user_id, change) pairs from users.change_user in one transaction"""
+    conn = get_connection()
+    with conn:
+        conn.executemany(SQL_CHANGE_USER, [
+            (
+                c['username'],
+                c['coins'],
+                int(c['reset']),
+                c['strike'],
+                c['best_strike'],
+                int(c['reset']),
+                c['strike'],
+                c['total_correct'],
+                c['games_played'],
+                user_id
+            )
+            for user_id, c in changes
+        ])
+
+def start_game(chat_id, user_id, character):
+    """Start a new game"""
+    conn = get_connection()
+    with conn:
+        # Remove any existing game in this chat
+        conn.execute(SQL_DELETE_GAME, (chat_id,))
+        # Add new game
+        conn.execute(SQL_INSERT_GAME, (chat_id, user_id, character['id'], character['name']))
+    return True
+
+def get_all_active_games():
+    """Get every active game, used to rebuild the in-memory registry
+
+    'deadline' is the saved Unix deadline (None if never saved) and
+    'started_at' the Unix time the game row was written.
+    """
+    results = get_connection().execute(SQL_ALL_GAMES).fetchall()
+    return [
+        {
+            'chat_id': r[0],
+            'character_name': r[1],
+            'user_id': r[2],
+            'character_id': r[3],
+            'image_path': r[4],
+            'deadline': r[5],
+            'started_at': r[6]
+        }
+        for r in results
+    ]
+
+def set_game_deadlines(deadlines):
+    """Save (chat_id, deadline) pairs in one transaction"""
+    if not deadlines:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(SQL_SET_DEADLINE, [(deadline, chat_id) for chat_id, deadline in deadlines])
+
+def end_game(chat_id):
+    """End active game"""
+    conn = get_connection()
+    with conn:
+        conn.execute(SQL_DELETE_GAME, (chat_id,))
+
+def end_games(chat_ids):
+    """End several active games in one transaction"""
+    if not chat_ids:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(SQL_DELETE_GAME, [(chat_id,) for chat_id in chat_ids])
+
+def get_leaderboard(mode, limit=10):
+    """Get top users for a sort mode as (user_id, username, coins, best_strike, total_correct)"""
+    return get_connection().execute(SQL_LEADERBOARD[mode], (limit,)).fetchall()
+
+def get_user_rank(mode, value):
+    """1-based rank of a value in a sort mode (index range count, no table scan)"""
+    return get_connection().execute(SQL_USER_RANK[mode], (value,)).fetchone()[0] + 1
+
+def add_chat_coins(chat_id, user_id, coins):
+    """Add coins to a user's total in one chat"""
+    conn = get_connection()
+    with conn:
+        conn.execute(SQL_ADD_CHAT_COINS, (chat_id, user_id, coins))
+
+def get_chat_leaderboard(chat_id, limit=10):
+    """Get top users of one chat by coins earned there"""
+    return get_connection().execute(SQL_CHAT_LEADERBOARD, (chat_id, limit)).fetchall()
+
+def get_chat_rank(chat_id, user_id):
+    """1-based rank of a user in one chat, or None if they have no coins there"""
+    conn = get_connection()
+    if conn.execute(SQL_CHAT_USER_EXISTS, (chat_id, user_id)).fetchone() is None:
+        return None
+    return conn.execute(SQL_CHAT_RANK, (chat_id, chat_id, user_id)).fetchone()[0] + 1
+
+# =============== ROUND HISTORY ===============
+def new_rollup():
+    """Empty round totals"""
+    return {'rounds': 0, 'correct': 0, 'wrong': 0, 'timeouts': 0, 'solve_ms': 0, 'fastest_ms': None}
+
+def add_to_rollup(rollup, outcome, response_ms):
+    """Count one round in a rollup ('expired' rounds are only logged)"""
+    if outcome == 'expired':
+        return
+    rollup['rounds'] += 1
+    if outcome == 'correct':
+        rollup['correct'] += 1
+        rollup['solve_ms'] += response_ms
+        if rollup['fastest_ms'] is None or response_ms < rollup['fastest_ms']:
+            rollup['fastest_ms'] = response_ms
+    elif outcome == 'wrong':
+        rollup['wrong'] += 1
+    else:
+        rollup['timeouts'] += 1
+
+def insert_rounds(rows):
+    """Append rows to the round log and fold them into the rollups in one transaction
+
+    Rows are (chat_id, user_id, character_id, outcome, response_ms, ended_at).
+    """
+    by_character = {}
+    by_player = {}
+    for _, user_id, character_id, outcome, response_ms, _ in rows:
+        if outcome == 'expired':
+            continue
+        add_to_rollup(by_character.setdefault(character_id, new_rollup()), outcome, response_ms)
+        add_to_rollup(by_player.setdefault(user_id, new_rollup()), outcome, response_ms)
+
+    conn = get_connection()
+    with conn:
+        conn.executemany(SQL_INSERT_ROUND, rows)
+        for table, rollups in (('character_stats', by_character), ('player_stats', by_player)):
+            conn.executemany(SQL_ADD_ROUND_STATS[table], [
+                (key, *(rollup[column] for column in ROLLUP_COLUMNS))
+                for key, rollup in rollups.items()
+            ])
+
+def get_player_round_stats(user_id):
+    """Round rollup of one player (empty if they have none)"""
+    row = get_connection().execute(SQL_PLAYER_STATS, (user_id,)).fetchone()
+    return dict(zip(ROLLUP_COLUMNS, row)) if row else new_rollup()
+
+def get_round_totals():
+    """(characters played, rounds, correct, total solve ms) over all characters"""
+    count, rounds, correct, solve_ms = get_connection().execute(SQL_ROUND_TOTALS).fetchone()
+    return count, rounds or 0, correct or 0, solve_ms or 0
+
+def get_character_stats_by_rate(hardest, min_rounds, limit):
+    """(name, rounds, correct, solve_ms, fastest_ms) by solve rate, hardest or easiest first"""
+    sql = SQL_CHARACTER_STATS_BY_RATE['ASC' if hardest else 'DESC']
+    return get_connection().execute(sql, (min_rounds, limit)).fetchall()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+import asyncio
+
+class WriteBehind:
+    """Periodic flush task for an in-memory write-behind buffer
+
+    flush writes out what is pending and returns the future of that DB
+    write (see database.submit_db), or None when nothing was pending.
+    """
+
+    def __init__(self, flush):
+        self._flush = flush
+        self._task = None
+
+    async def _loop(self, interval_ms):
+        """Flush every interval_ms"""
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            self._flush()
+
+    def start(self, interval_ms):
+        """Start the periodic flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(interval_ms))
+
+    async def stop(self):
+        """Stop the periodic flush task and write out everything pending"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        future = self._flush()
+        if future is not None:
+            await asyncio.wrap_future(future)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import time
+import itertools
+import database
+import scheduler
+from matching import build_index
+
+# Running games keyed by chat_id. This is the source of truth while the
+# bot is up; the active_games table is only written behind it so games
+# survive a restart.
+_active_games = {}
+
+# Round ids identify one round of one chat; timers are keyed by them so a
+# stale timer can never touch a later round in the same chat
+_round_ids = itertools.count(1)
+
+# =============== REGISTRY ===============
+def load_active_games(owns=None):
+    """Rebuild the registry from the active_games table
+
+    owns(chat_id) limits the registry to the chats this process serves.
+    """
+    games = database.get_all_active_games()
+    _active_games.clear()
+    for game in games:
+        if owns is not None and not owns(game['chat_id']):
+            continue
+        game['round_id'] = next(_round_ids)
+        game['match'] = build_index(game['character_name'])
+        game['shown_at'] = None
+        _active_games[game.pop('chat_id')] = game
+    return len(_active_games)
+
+def recover_rounds(time_limit, callback):
+    """Re-arm restored rounds that have time left and end the rest
+
+    One pass over the registry after load_active_games; the ended games
+    are deleted in one batched write and returned as (chat_id, game).
+    """
+    now = time.time()
+    expired = []
+    for chat_id, game in list(_active_games.items()):
+        started_at = game.pop('started_at', None)
+        if game['deadline'] is None and started_at is not None:
+            # Never saved (the process died): count from when the game started
+            game['deadline'] = started_at + time_limit
+        remaining = game['deadline'] - now if game['deadline'] is not None else 0
+        if remaining > 0:
+            game['shown_at'] = time.monotonic() - max(time_limit - remaining, 0)
+            scheduler.schedule(game['round_id'], remaining, callback, chat_id, game['round_id'])
+        else:
+            del _active_games[chat_id]
+            expired.append((chat_id, game))
+    if expired:
+        database.submit_db(database.end_games, [chat_id for chat_id, _ in expired])
+    return expired
+
+def save_deadlines():
+    """Persist every running round's deadline in one batched write
+
+    Rounds whose image never went out are ended instead: nobody saw them,
+    so a restart must neither time them nor reveal their answer.
+    """
+    deadlines = []
+    unshown = []
+    for chat_id, game in list(_active_games.items()):
+        if game.get('deadline') is None:
+            del _active_games[chat_id]
+            unshown.append(chat_id)
+        else:
+            deadlines.append((chat_id, game['deadline']))
+    if unshown:
+        database.submit_db(database.end_games, unshown)
+    if not deadlines:
+        return None
+    return database.submit_db(database.set_game_deadlines, deadlines)
+
+def get_active_game(chat_id):
+    """Get active game for chat (no I/O)"""
+    return _active_games.get(chat_id)
+
+def start_game(chat_id, user_id, character):
+    """Start a new game and persist it in the background; returns its round id"""
+    previous = _active_games.get(chat_id)
+    if previous is not None:
+        scheduler.cancel(previous['round_id'])
+    round_id = next(_round_ids)
+    _active_games[chat_id] = {
+        'round_id': round_id,
+        'character_name': character['name'],
+        'user_id': user_id,
+        'character_id': character['id'],
+        'image_path': character['image_path'],
+        'match': character.get('match') or build_index(character['name']),
+        # time.monotonic() when the image went out; response times count from it
+        'shown_at': None,
+        # time.time() when the round times out, set once its timer is armed
+        'deadline': None
+    }
+    database.submit_db(database.start_game, chat_id, user_id, character)
+    return round_id
+
+def mark_shown(chat_id, round_id):
+    """Note that a round's image reached the chat"""
+    game = _active_games.get(chat_id)
+    if game is not None and game['round_id'] == round_id:
+        game['shown_at'] = time.monotonic()
+
+def arm_round(chat_id, round_id, seconds, callback):
+    """Start a shown round's timer, noting its deadline for a restart"""
+    game = _active_games.get(chat_id)
+    if game is None or game['round_id'] != round_id:
+        return False
+    game['deadline'] = time.time() + seconds
+    scheduler.schedule(round_id, seconds, callback, chat_id, round_id)
+    return True
+
+def response_time(game):
+    """Seconds since a game's image was shown (0 if it never was)"""
+    if game.get('shown_at') is None:
+        return 0.0
+    return time.monotonic() - game['shown_at']
+
+def resolve_round(chat_id, round_id):
+    """End a round only if it is still the chat's current round
+
+    The compare-and-set that decides who resolves a round: returns the
+    game to whichever caller gets here first, and None to everyone else
+    (a second guess, or a timer racing a correct guess).
+    """
+    game = _active_games.get(chat_id)
+    if game is None or game['round_id'] != round_id:
+        return None
+    end_game(chat_id)
+    return game
+
+def end_game(chat_id):
+    """End active game, cancel its timer and delete it in the background"""
+    game = _active_games.pop(chat_id, None)
+    if game is not None:
+        scheduler.cancel(game['round_id'])
+        database.submit_db(database.end_game, chat_id)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import os
+import time
+import database
+import characters
+from flusher import WriteBehind
+
+# Batching (override with env vars)
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "2000"))
+HISTORY_FLUSH_BATCH = int(os.getenv("HISTORY_FLUSH_BATCH", "500"))
+
+# Rounds needed before a character's solve rate is ranked
+MIN_RANKED_ROUNDS = int(os.getenv("MIN_RANKED_ROUNDS", "5"))
+
+# Ended rounds not yet written, as rounds-table rows. Reads fold these in;
+# flushed rows are visible to them because the DB thread runs work in order.
+_pending = []
+
+# =============== RECORDING ===============
+def record_round(chat_id, user_id, character_id, outcome, response_seconds):
+    """Log one ended round (no I/O)
+
+    outcome is 'correct', 'wrong', 'timeout' or 'expired' (ran out while
+    the bot was down); expired rounds are logged but left out of every
+    rollup and solve rate, as the player never had the full time.
+    """
+    # The sampler's difficulty buckets follow solve rates as rounds end
+    if outcome != 'expired':
+        characters.record_result(character_id, outcome == 'correct')
+    _pending.append((
+        chat_id,
+        user_id,
+        character_id,
+        outcome,
+        int(response_seconds * 1000),
+        int(time.time())
+    ))
+    if len(_pending) >= HISTORY_FLUSH_BATCH:
+        flush_rounds()
+
+def flush_rounds():
+    """Write pending rounds and their rollups in one batched transaction"""
+    if not _pending:
+        return None
+    rows = _pending[:]
+    _pending.clear()
+    return database.submit_db(database.insert_rounds, rows)
+
+# =============== READING ===============
+async def get_player_stats(user_id):
+    """Round rollup of one player, including rounds not yet written"""
+    stats = await database.run_db(database.get_player_round_stats, user_id)
+    for _, player, _, outcome, response_ms, _ in _pending:
+        if player == user_id:
+            database.add_to_rollup(stats, outcome, response_ms)
+    return stats
+
+async def get_character_stats(limit=5):
+    """Totals plus the hardest and easiest characters, from the rollups only"""
+    flush_rounds()
+    totals = await database.run_db(database.get_round_totals)
+    hardest = await database.run_db(database.get_character_stats_by_rate, True, MIN_RANKED_ROUNDS, limit)
+    easiest = await database.run_db(database.get_character_stats_by_rate, False, MIN_RANKED_ROUNDS, limit)
+    return totals, hardest, easiest
+
+# =============== BACKGROUND FLUSH ===============
+_flusher = WriteBehind(flush_rounds)
+
+def start_history():
+    """Flush pending rounds every HISTORY_FLUSH_INTERVAL_MS"""
+    _flusher.start(HISTORY_FLUSH_INTERVAL_MS)
+
+async def stop_history():
+    """Stop the periodic flush and write out everything pending"""
+    await _flusher.stop()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Content-addressed image storage.
+
+Usage: python image_store.py gc [--dry-run]
+       python image_store.py migrate
+
+Images are stored once per content hash under
+images/objects/<h[:2]>/<h[2:4]>/<hash>.jpg, so names can never collide,
+duplicates share one file and no directory grows past a few hundred
+entries. `gc` deletes files no character references (run it while the
+bot is stopped); `migrate` moves images saved under the old
+name-based paths into the store.
+"""
+import os
+import sys
+import hashlib
+import argparse
+import database
+from images import VARIANT_DIR, VARIANTS, atomic_write, variant_path
+
+STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join("images", "objects"))
+
+# =============== STORE ===============
+def path_for(image_hash):
+    """Sharded path of an image hash"""
+    return os.path.join(STORE_DIR, image_hash[:2], image_hash[2:4], f"{image_hash}.jpg")
+
+def store_image(data, image_hash=None):
+    """Store image bytes once and return their path"""
+    if image_hash is None:
+        image_hash = hashlib.sha256(data).hexdigest()
+    path = path_for(image_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+    return path
+
+# =============== MAINTENANCE ===============
+def _walk_files(root):
+    """Every file below root"""
+    for directory, _, files in os.walk(root):
+        for name in files:
+            yield os.path.join(directory, name)
+
+def collect_garbage(dry_run=False):
+    """Delete stored images and variants no character references
+
+    Returns (files removed, bytes freed).
+    """
+    refs = database.get_image_refs()
+    keep = {os.path.normpath(path) for _, path, _ in refs}
+    hashes = {image_hash for _, _, image_hash in refs if image_hash}
+    for image_hash in hashes:
+        keep.add(os.path.normpath(path_for(image_hash)))
+        for variant in VARIANTS:
+            keep.add(os.path.normpath(variant_path(image_hash, variant)))
+
+    removed = 0
+    freed = 0
+    for root in (STORE_DIR, VARIANT_DIR):
+        for path in _walk_files(root):
+            if os.path.normpath(path) in keep:
+                continue
+            freed += os.path.getsize(path)
+            removed += 1
+            if not dry_run:
+                os.remove(path)
+
+    if not dry_run:
+        # Drop shard directories left empty
+        for root in (STORE_DIR, VARIANT_DIR):
+            for directory, _, _ in os.walk(root, topdown=False):
+                if directory != root and not os.listdir(directory):
+                    os.rmdir(directory)
+    return removed, freed
+
+def migrate_legacy():
+    """Move images stored under name-based paths into the store
+
+    Characters sharing a legacy file all move to its stored copy; legacy
+    files are deleted only once every character is migrated. Returns
+    (characters migrated, characters whose file is missing).
+    """
+    store_root = os.path.normpath(STORE_DIR) + os.sep
+    by_path = {}
+    for char_id, image_path, _ in database.get_image_refs():
+        if not os.path.normpath(image_path).startswith(store_root):
+            by_path.setdefault(image_path, []).append(char_id)
+
+    migrated = 0
+    missing = 0
+    moved = []
+    for image_path, char_ids in by_path.items():
+        try:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            missing += len(char_ids)
+            continue
+        image_hash = hashlib.sha256(data).hexdigest()
+        stored_path = store_image(data, image_hash)
+        for char_id in char_ids:
+            database.set_character_image(char_id, stored_path, image_hash)
+        migrated += len(char_ids)
+        moved.append(image_path)
+
+    for image_path in moved:
+        os.remove(image_path)
+    return migrated, missing
+
+# =============== CLI ===============
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed image store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    gc_parser = commands.add_parser('gc', help="delete unreferenced images")
+    gc_parser.add_argument('--dry-run', action='store_true', help="only report what would be deleted")
+    commands.add_parser('migrate', help="move name-based images into the store")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.command == 'migrate':
+        migrated, missing = migrate_legacy()
+        print(f"✅ Migrated {migrated} images ({missing} missing files)")
+    else:
+        removed, freed = collect_garbage(args.dry_run)
+        action = "Would remove" if args.dry_run else "Removed"
+        print(f"🧹 {action} {removed} files ({freed / 1024 / 1024:.1f} MB)")
+    database.shutdown_db()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
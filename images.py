@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import io
+import os
+import random
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Ingest settings (override with env vars)
+MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", "1280"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# Difficulty variants are cached here as <h[:2]>/<hash>_<variant>.jpg
+VARIANT_DIR = os.path.join("images", "variants")
+VARIANTS = ('crop', 'blur', 'silhouette')
+
+_pool = None
+
+# =============== FILES ===============
+def atomic_write(path, data):
+    """Write bytes to path through a temp file, so readers never see half a file"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+# =============== PREPROCESSING ===============
+def preprocess(data):
+    """Re-encode image bytes as a bounded, metadata-free JPEG
+
+    Returns (jpeg_bytes, sha256 hex of those bytes).
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white rather than black
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+        image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.LANCZOS)
+
+        out = io.BytesIO()
+        # No exif/icc arguments, so no metadata is written
+        image.save(out, 'JPEG', quality=IMAGE_QUALITY, optimize=True, progressive=True)
+    output = out.getvalue()
+    return output, hashlib.sha256(output).hexdigest()
+
+# =============== VARIANTS ===============
+def variant_path(image_hash, variant):
+    """Cached variant file for an image hash (may not exist yet)"""
+    return os.path.join(VARIANT_DIR, image_hash[:2], f"{image_hash}_{variant}.jpg")
+
+def pick_variant(image_hash):
+    """A random variant already rendered for an image hash, or None"""
+    rendered = [v for v in VARIANTS if os.path.exists(variant_path(image_hash, v))]
+    return random.choice(rendered) if rendered else None
+
+def _render_variants(image_path, image_hash):
+    """Write every missing variant of one image (runs in a worker process)"""
+    from PIL import Image, ImageFilter, ImageOps
+
+    missing = [v for v in VARIANTS if not os.path.exists(variant_path(image_hash, v))]
+    if not missing:
+        return 0
+
+    os.makedirs(os.path.dirname(variant_path(image_hash, VARIANTS[0])), exist_ok=True)
+    with Image.open(image_path) as image:
+        image = image.convert('RGB')
+        width, height = image.size
+        for variant in missing:
+            if variant == 'crop':
+                # Centre 40% of each side: enough to recognise, not enough to be easy
+                left, top = int(width * 0.3), int(height * 0.3)
+                result = image.crop((left, top, width - left, height - top))
+            elif variant == 'blur':
+                result = image.filter(ImageFilter.GaussianBlur(radius=max(width, height) / 60))
+            else:
+                # Dark shape on white: threshold the autocontrasted luminance
+                gray = ImageOps.autocontrast(image.convert('L'))
+                result = gray.point(lambda p: 0 if p < 200 else 255).convert('RGB')
+
+            out = io.BytesIO()
+            result.save(out, 'JPEG', quality=IMAGE_QUALITY)
+            atomic_write(variant_path(image_hash, variant), out.getvalue())
+    return len(missing)
+
+def queue_variants(image_path, image_hash):
+    """Render an image's variants in the background process pool"""
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the bot's event loop, DB thread and sockets
+        # must not be copied into the workers
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    future = _pool.submit(_render_variants, image_path, image_hash)
+    future.add_done_callback(_log_variant_error)
+    return future
+
+def _log_variant_error(future):
+    """Report failed variant renders"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("variant rendering failed: %s", future.exception())
+
+def shutdown_image_pool(wait=True):
+    """Stop the variant process pool"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=not wait)
+        _pool = None
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Bulk character import.
+
+Usage: python importer.py MANIFEST [--workers N] [--batch N]
+
+MANIFEST is a JSON list (like Characters.json), JSONL or CSV file whose
+rows have a name and an image (URL or path relative to the manifest),
+or a ZIP of images named after their characters, optionally with one
+of those manifests inside referencing the images by file name.
+"""
+import os
+import io
+import csv
+import sys
+import json
+import time
+import zipfile
+import argparse
+import threading
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import database
+from images import preprocess, queue_variants, shutdown_image_pool
+from image_store import store_image
+
+# Import tuning (override with env vars or CLI flags)
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "8"))
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "500"))
+DOWNLOAD_TIMEOUT = 30
+MAX_NAME_LENGTH = 100
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+# Manifest keys accepted for the image source, in order of preference
+IMAGE_KEYS = ('image', 'image_url', 'image_path', 'url', 'img', 'file')
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'RIFF')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+MANIFEST_EXTENSIONS = ('.json', '.jsonl', '.csv')
+
+# =============== MANIFESTS ===============
+def _parse_manifest(text, extension):
+    """Rows of a JSON, JSONL or CSV manifest as dicts"""
+    if extension == '.csv':
+        return list(csv.DictReader(io.StringIO(text)))
+    if extension == '.jsonl':
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    rows = json.loads(text)
+    return rows if isinstance(rows, list) else [rows]
+
+def _row_item(row):
+    """(name, image source) of a manifest row"""
+    if not isinstance(row, dict):
+        return None, None
+    name = str(row.get('name') or '').strip()
+    source = next((str(row[key]).strip() for key in IMAGE_KEYS if row.get(key)), '')
+    return name, source
+
+def read_manifest(path):
+    """Items to import as (name, source) pairs, plus the open ZIP if any"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension != '.zip':
+        with open(path, encoding='utf-8-sig') as f:
+            rows = _parse_manifest(f.read(), extension)
+        return [_row_item(row) for row in rows], None
+
+    archive = zipfile.ZipFile(path)
+    members = [m for m in archive.namelist() if not m.endswith('/')]
+    manifests = [m for m in members if m.lower().endswith(MANIFEST_EXTENSIONS)]
+    if manifests:
+        text = archive.read(manifests[0]).decode('utf-8-sig')
+        rows = _parse_manifest(text, os.path.splitext(manifests[0])[1].lower())
+        return [_row_item(row) for row in rows], archive
+
+    # No manifest: every image is named after its character
+    items = []
+    for member in members:
+        stem, extension = os.path.splitext(os.path.basename(member))
+        if extension.lower() in IMAGE_EXTENSIONS:
+            items.append((stem.replace('_', ' ').strip(), member))
+    return items, archive
+
+# =============== IMAGES ===============
+def _fetch(source, base_dir, archive, archive_lock):
+    """Preprocessed JPEG bytes and hash for a URL, a ZIP member or a local path"""
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=DOWNLOAD_TIMEOUT) as response:
+            data = response.read(MAX_IMAGE_BYTES + 1)
+    elif archive is not None:
+        with archive_lock:
+            data = archive.read(source)
+    else:
+        with open(os.path.join(base_dir, source), 'rb') as f:
+            data = f.read(MAX_IMAGE_BYTES + 1)
+
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError("image larger than 10 MB")
+    if not data.startswith(IMAGE_SIGNATURES):
+        raise ValueError("not a JPEG/PNG/GIF/WebP image")
+    return preprocess(data)
+
+# =============== PIPELINE ===============
+def import_manifest(path, workers=IMPORT_WORKERS, batch_size=IMPORT_BATCH):
+    """Validate, dedupe, fetch and insert every character in a manifest
+
+    Returns a report dict: total, imported (inserted records),
+    duplicates, failures ((name, reason) pairs) and seconds.
+    """
+    start = time.perf_counter()
+    report = {'total': 0, 'imported': [], 'duplicates': 0, 'failures': [], 'seconds': 0.0}
+
+    try:
+        items, archive = read_manifest(path)
+    except (OSError, ValueError, zipfile.BadZipFile, csv.Error) as e:
+        report['failures'].append((os.path.basename(path), f"unreadable manifest: {e}"))
+        return report
+    report['total'] = len(items)
+
+    # Existing names and hashes are read on the DB thread
+    names = {n.casefold() for n in database.submit_db(database.get_all_characters).result()}
+    hashes = database.submit_db(database.get_character_hashes).result()
+
+    # Validate and dedupe by name before fetching anything
+    queue = []
+    for name, source in items:
+        if not name or not source:
+            report['failures'].append((name or '?', "missing name or image"))
+        elif len(name) > MAX_NAME_LENGTH:
+            report['failures'].append((name[:20] + '...', "name too long"))
+        elif name.casefold() in names:
+            report['duplicates'] += 1
+        else:
+            names.add(name.casefold())
+            queue.append((name, source))
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    archive_lock = threading.Lock()
+    batch = []
+
+    def flush():
+        if batch:
+            inserted = database.submit_db(database.insert_characters, list(batch)).result()
+            for record in inserted:
+                queue_variants(record['image_path'], record['image_hash'])
+            report['imported'].extend(inserted)
+            report['duplicates'] += len(batch) - len(inserted)
+            batch.clear()
+
+    # Fetch in a bounded pool, keeping at most 2x workers downloads in flight
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as pool:
+        pending = deque()
+        remaining = iter(queue)
+        while True:
+            while len(pending) < workers * 2:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                pending.append((item, pool.submit(_fetch, item[1], base_dir, archive, archive_lock)))
+            if not pending:
+                break
+
+            (name, source), future = pending.popleft()
+            try:
+                data, image_hash = future.result()
+            except Exception as e:
+                report['failures'].append((name, str(e) or type(e).__name__))
+                continue
+
+            if image_hash in hashes:
+                report['duplicates'] += 1
+                continue
+            hashes.add(image_hash)
+
+            try:
+                image_path = store_image(data, image_hash)
+            except OSError as e:
+                report['failures'].append((name, f"cannot save image: {e}"))
+                continue
+
+            batch.append((name, image_path, image_hash))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+    if archive is not None:
+        archive.close()
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+def format_report(report, max_failures=20):
+    """Human-readable summary of an import report"""
+    seconds = report['seconds'] or 1e-9
+    imported = len(report['imported'])
+    lines = [
+        f"📦 Import finished in {report['seconds']:.1f}s",
+        f"✅ Imported: {imported} / {report['total']} ({imported / seconds:.1f} per second)",
+        f"♻️ Duplicates skipped: {report['duplicates']}",
+        f"❌ Failed: {len(report['failures'])}"
+    ]
+    for name, reason in report['failures'][:max_failures]:
+        lines.append(f"  • {name}: {reason}")
+    if len(report['failures']) > max_failures:
+        lines.append(f"  ... and {len(report['failures']) - max_failures} more")
+    return "\n".join(lines)
+
+# =============== CLI ===============
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import characters into the bot database")
+    parser.add_argument('manifest', help="JSON/JSONL/CSV manifest or ZIP of images")
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS, help="concurrent image fetches")
+    parser.add_argument('--batch', type=int, default=IMPORT_BATCH, help="rows per insert transaction")
+    args = parser.parse_args()
+
+    database.init_db()
+    report = import_manifest(args.manifest, args.workers, args.batch)
+    database.shutdown_db()
+    # Let the variant renders queued during the import finish
+    shutdown_image_pool(wait=True)
+    print(format_report(report, max_failures=len(report['failures'])))
+    print("ℹ️ A running bot picks up CLI imports on its next restart")
+    return 1 if report['failures'] and not report['imported'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import asyncio
+import database
+
+# Players shown per leaderboard
+LEADERBOARD_SIZE = 10
+# Chats whose rendered leaderboard is kept
+CHAT_CACHE_SIZE = 1000
+
+# Sort mode -> (user field, title)
+MODES = {
+    'coins': ('coins', "🏆 <b>Top 10 Players</b>"),
+    'strike': ('best_strike', "🔥 <b>Top 10 Strikes</b>"),
+    'correct': ('total_correct', "✅ <b>Top 10 Correct Answers</b>")
+}
+
+# Mode -> top players, best first. Every tracked stat only grows, so a
+# player outside the top K can only enter it through record_user.
+_boards = {mode: [] for mode in MODES}
+# Rendered HTML, dropped only when the board it was built from changes
+_rendered = {}
+_chat_rendered = {}
+
+def _entry(user_id, username, coins, best_strike, total_correct):
+    """Leaderboard row as a dict"""
+    return {
+        'user_id': user_id,
+        'username': username,
+        'coins': coins,
+        'best_strike': best_strike,
+        'total_correct': total_correct
+    }
+
+# =============== LOADING ===============
+async def load_leaderboards():
+    """Load each top-K board from the indexed users table"""
+    boards = await asyncio.gather(*(
+        database.run_db(database.get_leaderboard, mode, LEADERBOARD_SIZE)
+        for mode in MODES
+    ))
+    for mode, rows in zip(MODES, boards):
+        _boards[mode] = [_entry(*row) for row in rows]
+    _rendered.clear()
+
+# =============== UPDATES ===============
+def record_user(user_data):
+    """Fold a user's new stats into the top-K boards"""
+    new = _entry(
+        user_data['user_id'],
+        user_data['username'],
+        user_data['coins'],
+        user_data['best_strike'],
+        user_data['total_correct']
+    )
+    for mode, (field, _) in MODES.items():
+        board = _boards[mode]
+        position = next((i for i, e in enumerate(board) if e['user_id'] == new['user_id']), None)
+
+        if position is None:
+            if new[field] <= 0:
+                continue
+            if len(board) >= LEADERBOARD_SIZE and new[field] <= board[-1][field]:
+                continue
+            board.append(dict(new))
+        elif board[position] == new:
+            continue
+        else:
+            board[position] = dict(new)
+
+        board.sort(key=lambda e: e[field], reverse=True)
+        del board[LEADERBOARD_SIZE:]
+        _rendered.pop(mode, None)
+
+def record_chat_coins(chat_id, user_id, coins):
+    """Add coins to a user's per-chat total"""
+    _chat_rendered.pop(chat_id, None)
+    database.submit_db(database.add_chat_coins, chat_id, user_id, coins)
+
+# =============== RENDERING ===============
+def _render(title, rows):
+    """Build the leaderboard HTML"""
+    parts = [f"{title}\n\n"]
+    for i, entry in enumerate(rows, 1):
+        if i == 1: medal = "🥇"
+        elif i == 2: medal = "🥈"
+        elif i == 3: medal = "🥉"
+        else: medal = f"{i}."
+
+        display_name = entry['username'] or f"Player{i}"
+        if len(display_name) > 15:
+            display_name = display_name[:12] + "..."
+
+        parts.append(f"{medal} <b>{display_name}</b>\n")
+        parts.append(
+            f"   💰 {entry['coins']} coins | 🔥 {entry['best_strike']} strikes | "
+            f"✅ {entry['total_correct']}\n\n"
+        )
+    return "".join(parts)
+
+def get_leaderboard_text(mode='coins'):
+    """Rendered global leaderboard, or None if nobody has scored"""
+    if not _boards[mode]:
+        return None
+    text = _rendered.get(mode)
+    if text is None:
+        text = _rendered[mode] = _render(MODES[mode][1], _boards[mode])
+    return text
+
+async def get_chat_leaderboard_text(chat_id):
+    """Rendered leaderboard of one chat, or None if nobody has scored there"""
+    text = _chat_rendered.get(chat_id)
+    if text is None:
+        rows = await database.run_db(database.get_chat_leaderboard, chat_id, LEADERBOARD_SIZE)
+        if not rows:
+            return None
+        if len(_chat_rendered) >= CHAT_CACHE_SIZE:
+            _chat_rendered.clear()
+        text = _chat_rendered[chat_id] = _render(
+            "🏆 <b>Top 10 in This Chat</b>",
+            [_entry(*row) for row in rows]
+        )
+    return text
+
+# =============== RANKS ===============
+async def get_rank(mode, user_data):
+    """1-based global rank of a user, or None if they have not scored"""
+    field = MODES[mode][0]
+    if user_data[field] <= 0:
+        return None
+    for i, entry in enumerate(_boards[mode], 1):
+        if entry['user_id'] == user_data['user_id']:
+            return i
+    return await database.run_db(database.get_user_rank, mode, user_data[field])
+
+async def get_chat_rank(chat_id, user_id):
+    """1-based rank of a user in one chat, or None if they have not scored there"""
+    return await database.run_db(database.get_chat_rank, chat_id, user_id)
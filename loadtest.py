@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+"""Offline load test: simulated chats play through the real handlers.
+
+Usage: python loadtest.py [--chats N[,N...]] [--workers N[,N...]] [--rounds N]
+                          [--accuracy P] [--timeouts P] [--think-ms MS] [--ramp-ms MS]
+                          [--api-latency-ms MS] [--concurrent N] [--json]
+                          [--max-p99-ms MS] [--telegram-limits] [--saturate ROUNDS]
+
+Each simulated chat sends /splay, waits for the round image, "thinks",
+then guesses right (with probability --accuracy), wrong, or not at all
+(--timeouts), and now and then asks for /sprofile or /sleaderboard. A
+guess that arrives after the round ran out gets "Time's up", and the
+player starts the next round with /splay, as a real one would.
+Updates go through the normal Application (update queue, handler
+groups, concurrent_updates) with a fake Bot API request object in place
+of Telegram, against a throwaway database.
+
+Every run happens in fresh processes. With several --chats values the
+report shows whether latency stays flat as chats are added; with
+several --workers values the chats are split over that many processes
+sharing one database, as in sharded mode. Players wait for each answer
+(closed loop), so that throughput is the offered load, not capacity.
+
+--saturate ROUNDS measures capacity instead: it starts the real sharding
+router with --workers worker processes, queues ROUNDS rounds for every
+chat at once (no think time) and times how long the workers take to
+answer them all.
+Use --max-p99-ms in CI to fail when p99 latency regresses. The send
+queue's rate limits are off unless --telegram-limits is given, so the
+report measures the bot rather than Telegram's flood limits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import tempfile
+import multiprocessing
+
+TOKEN = "123456:loadtest"
+# Seconds a player waits for the bot before counting a stall
+STALL_TIMEOUT = 60
+# How the bot's "Time's up" message starts
+TIMES_UP = "⏰"
+# How round result messages start (correct, wrong, time's up)
+RESULT_MARKS = ("✅", "❌", TIMES_UP)
+
+# =============== FAKE BOT API ===============
+def _fake_request_class():
+    """FakeRequest is defined lazily so the parent never imports telegram"""
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        """Answers Bot API calls locally and hands bot messages to the players"""
+
+        def __init__(self, latency=0.0, results=None):
+            self.latency = latency
+            # multiprocessing queue told the chat of every round result, if any
+            self.results = results
+            self.calls = {}
+            self.inbox = {}
+            self._message_id = 0
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        def mailbox(self, chat_id):
+            """Queue of (method, text) the bot sent to a chat"""
+            box = self.inbox.get(chat_id)
+            if box is None:
+                box = self.inbox[chat_id] = asyncio.Queue()
+            return box
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            endpoint = url.rsplit('/', 1)[-1]
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            params = request_data.parameters if request_data else {}
+
+            if endpoint == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': "LoadTest", 'username': "loadtest_bot"}
+            elif endpoint in ('sendMessage', 'sendPhoto', 'editMessageText'):
+                self._message_id += 1
+                chat_id = int(params.get('chat_id', 0))
+                result = {
+                    'message_id': self._message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'}
+                }
+                if endpoint == 'sendPhoto':
+                    result['photo'] = [{'file_id': f"photo-{self._message_id}", 'file_unique_id': "u",
+                                        'width': 1, 'height': 1}]
+                text = params.get('text') or params.get('caption') or ""
+                self.mailbox(chat_id).put_nowait((endpoint, text))
+                if self.results is not None and text.startswith(RESULT_MARKS):
+                    self.results.put(chat_id)
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return FakeRequest
+
+# =============== SIMULATION ===============
+def _rss_mb():
+    """Current resident set size in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def _drive(config, index):
+    """Run this process's share of the chats and return its measurements"""
+    import main
+    import games
+    import users
+    import sender
+    import metrics
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    if config['workers'] > 1:
+        # Same settings as a shard worker
+        users.USER_CACHE_SIZE = 0
+    main.NEXT_ROUND_DELAY = config['next_round_delay']
+    main.CONCURRENT_UPDATES = config['concurrent']
+    if not config['telegram_limits']:
+        sender.SEND_GLOBAL_RATE = sender.SEND_CHAT_RATE = sender.SEND_GROUP_RATE = 0
+
+    request = _fake_request_class()(config['api_latency_ms'] / 1000)
+    application = main.build_application(TOKEN, request)
+
+    sent_at = {}
+    latencies = []
+    update_ids = iter(range(index * 10_000_000 + 1, (index + 1) * 10_000_000))
+
+    async def done(update, _context):
+        # Group 1 runs after the game handler in group 0 has finished
+        start = sent_at.pop(update.update_id, None)
+        if start is not None:
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    application.add_handler(TypeHandler(Update, done), group=1)
+
+    async def send(chat_id, user_id, text):
+        update_id = next(update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Player{user_id}"},
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        sent_at[update_id] = time.perf_counter()
+        await application.update_queue.put(Update.de_json({'update_id': update_id, 'message': message}, application.bot))
+
+    stalls = 0
+
+    async def expect(chat_id, endpoint):
+        """Wait for the bot's next call of one kind to this chat; returns its text"""
+        box = request.mailbox(chat_id)
+        while True:
+            got, text = await asyncio.wait_for(box.get(), STALL_TIMEOUT)
+            if got == endpoint:
+                return text
+
+    async def play(chat_id):
+        nonlocal stalls
+        rng = random.Random(chat_id)
+        user_id = 1_000_000 + chat_id
+        try:
+            # Chats join over the ramp-up instead of all at once
+            await asyncio.sleep(rng.uniform(0, config['ramp_ms'] / 1000))
+            await send(chat_id, user_id, '/splay')
+            for _ in range(config['rounds']):
+                await expect(chat_id, 'sendPhoto')
+                await asyncio.sleep(rng.expovariate(1000 / config['think_ms']) if config['think_ms'] else 0)
+
+                timed_out = False
+                if rng.random() < config['side_commands']:
+                    await send(chat_id, user_id, rng.choice(('/sprofile', '/sleaderboard')))
+                    if (await expect(chat_id, 'sendMessage')).startswith(TIMES_UP):
+                        # The round ran out first; the reply comes next
+                        timed_out = True
+                        await expect(chat_id, 'sendMessage')
+
+                roll = rng.random()
+                if timed_out or roll < config['timeouts']:
+                    # Stay silent: the round timer ends it
+                    if not timed_out:
+                        await expect(chat_id, 'sendMessage')
+                    await send(chat_id, user_id, '/splay')
+                    continue
+                game = games.get_active_game(chat_id)
+                correct = game is not None and roll < config['timeouts'] + config['accuracy']
+                await send(chat_id, user_id, game['character_name'] if correct else "definitely not it")
+                # A guess that lands after the timer gets "Time's up" instead
+                result = await expect(chat_id, 'sendMessage')
+                if not correct or result.startswith(TIMES_UP):
+                    await send(chat_id, user_id, '/splay')
+                # After a correct guess the next round starts by itself
+        except asyncio.TimeoutError:
+            stalls += 1
+
+    chats = range(index + 1, config['chats'] + 1, config['workers'])
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    rss_start = _rss_mb()
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(play(chat_id) for chat_id in chats))
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    rss_end = _rss_mb()
+
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    db_calls = sum(count for count, _, _ in metrics.snapshot('db_seconds').values())
+    return {
+        'updates': len(latencies),
+        'seconds': seconds,
+        'latencies': latencies,
+        'rounds': metrics.counters('rounds_total').get('started', 0),
+        'db_calls': db_calls,
+        'api_calls': sum(request.calls.values()),
+        'stalls': stalls,
+        'cpu_seconds': cpu_seconds,
+        'handler_buckets': metrics.bucket_counts('handler_seconds'),
+        'rss_start': rss_start,
+        'rss_end': rss_end
+    }
+
+def _run_process(config, index, results):
+    """Entry point of one load-test process"""
+    os.environ['DB_PATH'] = config['db_path']
+    os.environ['TIME_LIMIT'] = str(config['time_limit'])
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['METRICS_PORT'] = '0'
+    results.put(asyncio.run(_drive(config, index)))
+
+# =============== SATURATION ===============
+def _result_request(results):
+    """Worker-side fake Bot API that reports each round result to the harness"""
+    return _fake_request_class()(results=results)
+
+async def _saturate(config, results):
+    """Queue every chat's rounds through the sharding router at once and time the drain
+
+    Each round is /splay then a wrong guess: exactly one result per
+    round and no auto-advance, so the count of results says when the
+    workers are done.
+    """
+    import queue
+    import functools
+    from telegram import Update
+    import sharding
+
+    workers = config['workers']
+    request = _fake_request_class()()
+    application = sharding.build_router(
+        TOKEN, workers, request, functools.partial(_result_request, results)
+    )
+    update_ids = itertools.count(1)
+
+    def update(chat_id, text):
+        update_id = next(update_ids)
+        message = {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1_000_000 + chat_id, 'is_bot': False, 'first_name': f"Player{chat_id}"},
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return Update.de_json({'update_id': update_id, 'message': message}, application.bot)
+
+    def rounds(chat_ids, count):
+        return [u for _ in range(count) for chat_id in chat_ids
+                for u in (update(chat_id, '/splay'), update(chat_id, "definitely not it"))]
+
+    loop = asyncio.get_running_loop()
+
+    async def drain(updates, expected):
+        """Queue updates and wait for `expected` results; returns (seconds, missing)"""
+        start = time.perf_counter()
+        for u in updates:
+            await application.update_queue.put(u)
+        for received in range(expected):
+            try:
+                await loop.run_in_executor(None, functools.partial(results.get, timeout=STALL_TIMEOUT))
+            except queue.Empty:
+                return time.perf_counter() - start, expected - received
+        return time.perf_counter() - start, 0
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    # One round on a chat of every worker, so none is still starting up
+    ring = sharding.HashRing(range(workers))
+    warm = {}
+    for chat_id in itertools.count(10 ** 9):
+        warm.setdefault(ring.node_for(chat_id), chat_id)
+        if len(warm) == workers:
+            break
+    _, missing = await drain(rounds(list(warm.values()), 1), workers)
+
+    chat_ids = list(range(1, config['chats'] + 1))
+    updates = rounds(chat_ids, config['saturate'])
+    seconds, stalls = await drain(updates, len(chat_ids) * config['saturate'])
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    return {'updates': len(updates), 'seconds': seconds, 'stalls': stalls + missing}
+
+def _run_saturate_process(config, report):
+    """Entry point of the router process of a saturation run"""
+    os.environ['DB_PATH'] = config['db_path']
+    # Rounds end on the wrong guess; no timer should fire mid-run
+    os.environ['TIME_LIMIT'] = "600"
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['METRICS_PORT'] = '0'
+    if not config['telegram_limits']:
+        # Read by the sender of every worker at import
+        for name in ('SEND_GLOBAL_RATE', 'SEND_CHAT_RATE', 'SEND_GROUP_RATE'):
+            os.environ[name] = '0'
+    results = multiprocessing.get_context('spawn').Queue()
+    report.put(asyncio.run(_saturate(config, results)))
+
+def run_saturate(args, chats, workers):
+    """One saturation run through the router; returns its report"""
+    directory = tempfile.mkdtemp(prefix="nguess-load-")
+    config = {
+        'db_path': os.path.join(directory, "load.db"),
+        'chats': chats,
+        'workers': workers,
+        'saturate': args.saturate,
+        'telegram_limits': args.telegram_limits
+    }
+    _seed(config['db_path'], args.roster)
+
+    context = multiprocessing.get_context('spawn')
+    report = context.Queue()
+    process = context.Process(target=_run_saturate_process, args=(config, report), name="load-router")
+    process.start()
+    result = report.get()
+    process.join()
+    return {
+        'chats': chats,
+        'workers': workers,
+        'updates': result['updates'],
+        'seconds': result['seconds'],
+        'updates_per_second': result['updates'] / result['seconds'],
+        'stalls': result['stalls']
+    }
+
+def _print_saturate_report(reports):
+    """Saturation results, with throughput relative to one worker"""
+    print(f"{'chats':>7} {'workers':>7} {'updates':>8} {'drain s':>8} {'upd/s':>9} {'vs 1':>6} {'stalls':>6}")
+    single = {r['chats']: r['updates_per_second'] for r in reports if r['workers'] == 1}
+    for r in reports:
+        speedup = f"{r['updates_per_second'] / single[r['chats']]:.2f}x" if r['chats'] in single else "-"
+        print(f"{r['chats']:>7} {r['workers']:>7} {r['updates']:>8} {r['seconds']:>8.2f} "
+              f"{r['updates_per_second']:>9.0f} {speedup:>6} {r['stalls']:>6}")
+    print(f"({os.cpu_count()} CPUs: workers beyond that share cores)")
+
+# =============== ORCHESTRATION ===============
+def _seed(db_path, size):
+    """Create the database and a roster of synthetic characters"""
+    os.environ['DB_PATH'] = db_path
+    import database
+    database.DB_PATH = db_path
+    database.close_connection()
+    database.init_db()
+
+    image_path = os.path.join(os.path.dirname(db_path), "character.jpg")
+    with open(image_path, 'wb') as f:
+        f.write(b'\xff\xd8\xff\xe0' + bytes(1024))
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            'INSERT INTO characters (name, image_path) VALUES (?, ?)',
+            ((f"Loadtest Character {i}", image_path) for i in range(size))
+        )
+    database.close_connection()
+
+def _router_rate(workers, count=20000):
+    """Updates/s the sharding router can serialize and queue for workers"""
+    from telegram import Update
+    from sharding import HashRing, shard_key
+
+    context = multiprocessing.get_context('spawn')
+    ring = HashRing(range(workers))
+    queues = [context.Queue() for _ in range(workers)]
+    updates = [
+        Update.de_json({'update_id': i, 'message': {
+            'message_id': i, 'date': 0, 'chat': {'id': i % 5000, 'type': 'private'},
+            'from': {'id': i % 5000, 'is_bot': False, 'first_name': "P"}, 'text': "guess"
+        }}, None)
+        for i in range(count)
+    ]
+    start = time.perf_counter()
+    for update in updates:
+        queues[ring.node_for(shard_key(update))].put(update.to_json())
+    seconds = time.perf_counter() - start
+    for queue in queues:
+        queue.cancel_join_thread()
+    return count / seconds
+
+def run_config(args, chats, workers):
+    """One load-test run in fresh processes; returns the combined report"""
+    directory = tempfile.mkdtemp(prefix="nguess-load-")
+    config = {
+        'db_path': os.path.join(directory, "load.db"),
+        'chats': chats,
+        'workers': workers,
+        'rounds': args.rounds,
+        'accuracy': args.accuracy,
+        'timeouts': args.timeouts,
+        'side_commands': args.side_commands,
+        'think_ms': args.think_ms,
+        'ramp_ms': args.ramp_ms,
+        'api_latency_ms': args.api_latency_ms,
+        'concurrent': args.concurrent,
+        'time_limit': args.time_limit,
+        'next_round_delay': args.next_round_delay,
+        'telegram_limits': args.telegram_limits
+    }
+    _seed(config['db_path'], args.roster)
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=_run_process, args=(config, index, results), name=f"load-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    parts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = sorted(l for part in parts for l in part['latencies'])
+    updates = sum(part['updates'] for part in parts)
+    seconds = max(part['seconds'] for part in parts)
+    rounds = sum(part['rounds'] for part in parts) or 1
+    return {
+        'chats': chats,
+        'workers': workers,
+        'updates': updates,
+        'updates_per_second': updates / seconds,
+        'p50_ms': _percentile(latencies, 0.50),
+        'p90_ms': _percentile(latencies, 0.90),
+        'p99_ms': _percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+        'rounds': rounds,
+        'db_calls_per_round': sum(part['db_calls'] for part in parts) / rounds,
+        'api_calls_per_round': sum(part['api_calls'] for part in parts) / rounds,
+        'rss_growth_mb': sum(part['rss_end'] - part['rss_start'] for part in parts),
+        'stalls': sum(part['stalls'] for part in parts),
+        # Time inside the handlers, without the wait in the update queue
+        'handler_p99_ms': _bucket_percentile(
+            [sum(counts) for counts in zip(*(part['handler_buckets'] for part in parts))], 0.99
+        ),
+        # Process CPU per update; 1000 / this is roughly one process's ceiling in upd/s
+        'cpu_ms_per_update': sum(part['cpu_seconds'] for part in parts) * 1000 / max(updates, 1)
+    }
+
+def _bucket_percentile(counts, fraction):
+    """Upper bound in ms of the histogram bucket holding a percentile"""
+    from metrics import LATENCY_BUCKETS
+    target = fraction * sum(counts)
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        seen += count
+        if seen >= target:
+            return bound * 1000
+    return float('inf')
+
+def _print_report(reports):
+    """Results as a table, plus throughput relative to one worker"""
+    print(f"{'chats':>7} {'workers':>7} {'updates':>8} {'upd/s':>9} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8} {'hdl p99':>8} {'cpu/upd':>8} {'db/round':>9} {'api/round':>9} "
+          f"{'rss +MB':>8} {'stalls':>6}")
+    for r in reports:
+        print(f"{r['chats']:>7} {r['workers']:>7} {r['updates']:>8} {r['updates_per_second']:>9.0f} "
+              f"{r['p50_ms']:>8.2f} {r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f} "
+              f"{r['handler_p99_ms']:>8.1f} {r['cpu_ms_per_update']:>8.2f} "
+              f"{r['db_calls_per_round']:>9.1f} {r['api_calls_per_round']:>9.1f} "
+              f"{r['rss_growth_mb']:>8.1f} {r['stalls']:>6}")
+
+    single = {r['chats']: r['updates_per_second'] for r in reports if r['workers'] == 1}
+    for r in reports:
+        if r['workers'] > 1 and r['chats'] in single:
+            print(f"{r['workers']} workers, {r['chats']} chats: "
+                  f"{r['updates_per_second'] / single[r['chats']]:.2f}x one worker "
+                  f"(router ceiling {r['router_updates_per_second']:.0f} upd/s)")
+
+def _int_list(text):
+    return [int(part) for part in text.split(',') if part]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=_int_list, default=[1000], help="simulated chats (comma list)")
+    parser.add_argument('--workers', type=_int_list, default=[1], help="game processes (comma list)")
+    parser.add_argument('--rounds', type=int, default=5, help="rounds each chat plays")
+    parser.add_argument('--accuracy', type=float, default=0.7, help="share of rounds guessed right")
+    parser.add_argument('--timeouts', type=float, default=0.05, help="share of rounds left to time out")
+    parser.add_argument('--side-commands', type=float, default=0.1,
+                        help="chance per round of a /sprofile or /sleaderboard")
+    parser.add_argument('--think-ms', type=float, default=200, help="mean time before guessing")
+    parser.add_argument('--ramp-ms', type=float, default=2000, help="period over which chats join")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="fake Bot API round trip")
+    parser.add_argument('--concurrent', type=int, default=int(os.getenv("CONCURRENT_UPDATES", "1")),
+                        help="concurrent_updates of each Application")
+    # Well above the handlers' p99 at 1000 chats plus think time, so only
+    # --timeouts rounds run out
+    parser.add_argument('--time-limit', type=int, default=5, help="round time limit in seconds")
+    parser.add_argument('--next-round-delay', type=float, default=0.2, help="pause after a correct guess")
+    parser.add_argument('--roster', type=int, default=2000, help="characters in the test database")
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="pace sends at Telegram's rate limits")
+    parser.add_argument('--saturate', type=int, default=0, metavar='ROUNDS',
+                        help="instead: queue ROUNDS rounds per chat at once through the sharding "
+                             "router and time the drain")
+    parser.add_argument('--json', action='store_true', help="print the reports as JSON")
+    parser.add_argument('--max-p99-ms', type=float, help="exit 1 if any run's p99 latency is higher")
+    args = parser.parse_args()
+
+    reports = []
+    for chats in args.chats:
+        for workers in args.workers:
+            if args.saturate:
+                reports.append(run_saturate(args, chats, workers))
+                continue
+            report = run_config(args, chats, workers)
+            if workers > 1:
+                report['router_updates_per_second'] = _router_rate(workers)
+            reports.append(report)
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    elif args.saturate:
+        _print_saturate_report(reports)
+    else:
+        _print_report(reports)
+
+    failed = [r for r in reports if r['stalls'] or (args.max_p99_ms and r.get('p99_ms', 0) > args.max_p99_ms)]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 import os
-import sqlite3
+import sys
+import html
+import time
 import random
 import asyncio
 import logging
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
     ContextTypes,
@@ -19,237 +24,89 @@ from telegram.ext import (
 # Load environment variables
 load_dotenv()
 
-# Enable logging
+# Enable logging (LOG_LEVEL=DEBUG adds per-message events)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    format='%(asctime)s level=%(levelname)s logger=%(name)s %(message)s',
+    level=LOG_LEVEL
 )
+# httpx logs every Bot API request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# =============== DATABASE SETUP ===============
-def init_db():
-    """Initialize SQLite database"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    
-    # Characters table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS characters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            image_path TEXT NOT NULL,
-            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            coins INTEGER DEFAULT 0,
-            current_strike INTEGER DEFAULT 0,
-            best_strike INTEGER DEFAULT 0,
-            total_correct INTEGER DEFAULT 0,
-            games_played INTEGER DEFAULT 0,
-            last_played TIMESTAMP
-        )
-    ''')
-    
-    # Active games table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS active_games (
-            chat_id INTEGER PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            character_id INTEGER NOT NULL,
-            character_name TEXT NOT NULL,
-            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (character_id) REFERENCES characters (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("✅ Database initialized")
+# Seconds a player has to answer
+TIME_LIMIT = int(os.getenv("TIME_LIMIT", "30"))
+# Pause between a correct guess and the next round
+NEXT_ROUND_DELAY = 3
+# "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Updates handled at once; 1 keeps strict per-bot ordering
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+# Worker processes in sharded mode (0/1 = single process)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
 
-# Initialize database
-init_db()
-
-# =============== DATABASE FUNCTIONS ===============
-def add_character(name, image_path):
-    """Add a new character to database"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO characters (name, image_path) VALUES (?, ?)',
-            (name, image_path)
-        )
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
-
-def get_random_character():
-    """Get a random character from database"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, image_path FROM characters ORDER BY RANDOM() LIMIT 1')
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'id': result[0],
-            'name': result[1],
-            'image_path': result[2]
-        }
-    return None
-
-def get_all_characters():
-    """Get all characters"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name FROM characters ORDER BY name')
-    results = cursor.fetchall()
-    conn.close()
-    return [r[0] for r in results]
-
-def get_user(user_id):
-    """Get or create user"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'SELECT * FROM users WHERE user_id = ?',
-        (user_id,)
-    )
-    user = cursor.fetchone()
-    
-    if not user:
-        cursor.execute(
-            'INSERT INTO users (user_id, username) VALUES (?, ?)',
-            (user_id, '')
-        )
-        conn.commit()
-        conn.close()
-        return {
-            'user_id': user_id,
-            'username': '',
-            'coins': 0,
-            'current_strike': 0,
-            'best_strike': 0,
-            'total_correct': 0,
-            'games_played': 0
-        }
-    
-    conn.close()
-    return {
-        'user_id': user[0],
-        'username': user[1] or '',
-        'coins': user[2],
-        'current_strike': user[3],
-        'best_strike': user[4],
-        'total_correct': user[5],
-        'games_played': user[6] or 0
-    }
-
-def update_user(user_data):
-    """Update user stats"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE users SET
-            username = ?,
-            coins = ?,
-            current_strike = ?,
-            best_strike = ?,
-            total_correct = ?,
-            games_played = ?,
-            last_played = CURRENT_TIMESTAMP
-        WHERE user_id = ?
-    ''', (
-        user_data['username'],
-        user_data['coins'],
-        user_data['current_strike'],
-        user_data['best_strike'],
-        user_data['total_correct'],
-        user_data['games_played'],
-        user_data['user_id']
-    ))
-    
-    conn.commit()
-    conn.close()
-
-def start_game(chat_id, user_id, character):
-    """Start a new game"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    
-    # Remove any existing game in this chat
-    cursor.execute('DELETE FROM active_games WHERE chat_id = ?', (chat_id,))
-    
-    # Add new game
-    cursor.execute('''
-        INSERT INTO active_games (chat_id, user_id, character_id, character_name)
-        VALUES (?, ?, ?, ?)
-    ''', (chat_id, user_id, character['id'], character['name']))
-    
-    conn.commit()
-    conn.close()
-    return True
-
-def get_active_game(chat_id):
-    """Get active game for chat"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT ag.character_name, ag.user_id, c.image_path
-        FROM active_games ag
-        JOIN characters c ON ag.character_id = c.id
-        WHERE ag.chat_id = ?
-    ''', (chat_id,))
-    
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'character_name': result[0],
-            'user_id': result[1],
-            'image_path': result[2]
-        }
-    return None
-
-def end_game(chat_id):
-    """End active game"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM active_games WHERE chat_id = ?', (chat_id,))
-    conn.commit()
-    conn.close()
-
-def get_top_users(limit=10):
-    """Get top users by coins"""
-    conn = sqlite3.connect('anime_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT username, coins, best_strike, total_correct 
-        FROM users 
-        WHERE coins > 0 
-        ORDER BY coins DESC 
-        LIMIT ?
-    ''', (limit,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    return results
+# =============== DATABASE ===============
+from database import (
+    init_db,
+    run_db,
+    close_connection,
+    shutdown_db
+)
+from characters import (
+    load_characters,
+    add_character,
+    get_random_character,
+    add_records,
+    set_file_id,
+    variant_file_id,
+    VARIANT_STRIKE
+)
+from users import (
+    get_user,
+    change_user,
+    start_flusher,
+    stop_flusher
+)
+from leaderboard import (
+    MODES as LEADERBOARD_MODES,
+    load_leaderboards,
+    record_chat_coins,
+    get_leaderboard_text,
+    get_chat_leaderboard_text,
+    get_rank,
+    get_chat_rank
+)
+from roster import get_page as get_roster_page, invalidate_pages
+from matching import match_guess
+from metrics import (
+    timed_handler,
+    observe,
+    inc,
+    snapshot,
+    counters,
+    start_metrics_server,
+    stop_metrics_server
+)
+from scheduler import schedule, shutdown_scheduler
+from sender import HIGH, send, reply, start_sender, stop_sender
+from games import (
+    load_active_games,
+    recover_rounds,
+    save_deadlines,
+    start_game,
+    get_active_game,
+    resolve_round,
+    mark_shown,
+    arm_round,
+    response_time
+)
+from history import (
+    record_round,
+    get_player_stats,
+    get_character_stats,
+    start_history,
+    stop_history
+)
 
 # =============== GAME LOGIC ===============
 def calculate_coins(strike):
@@ -263,9 +120,47 @@ def calculate_coins(strike):
     elif strike % 10 == 0: return 100
     else: return 20
 
-def check_guess(user_guess, correct_name):
-    """Check if guess is correct (case-insensitive)"""
-    return user_guess.strip().lower() == correct_name.strip().lower()
+async def send_character_photo(chat_id, character, caption, variant=None):
+    """Send a character image or one of its variants, reusing Telegram's cached file_id"""
+    if variant is None:
+        file_id, image_path = character.get('file_id'), character['image_path']
+    else:
+        from images import variant_path
+        file_id = variant_file_id(character['id'], variant)
+        image_path = variant_path(character['image_hash'], variant)
+    if file_id:
+        start = time.perf_counter()
+        try:
+            sent = await send(
+                'send_photo',
+                chat_id,
+                HIGH,
+                photo=file_id,
+                caption=caption,
+                parse_mode="HTML"
+            )
+            observe('image_send_seconds', time.perf_counter() - start, method='file_id')
+            return sent
+        except BadRequest as e:
+            # file_id expired or was rejected; fall back to uploading
+            logger.warning("cached file_id failed character=%s: %s", character['id'], e)
+            set_file_id(character['id'], None, variant)
+
+    start = time.perf_counter()
+    # Bytes rather than the open file, so a retried send uploads it again
+    with open(image_path, 'rb') as image:
+        photo = image.read()
+    sent = await send(
+        'send_photo',
+        chat_id,
+        HIGH,
+        photo=photo,
+        caption=caption,
+        parse_mode="HTML"
+    )
+    observe('image_send_seconds', time.perf_counter() - start, method='upload')
+    set_file_id(character['id'], sent.photo[-1].file_id, variant)
+    return sent
 
 # =============== COMMAND HANDLERS ===============
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -273,13 +168,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
     
-    print(f"\n🚀 /start command from {user_id}")
+    logger.debug("command=start user=%s", user_id)
     
-    user_data = get_user(user_id)
-    user_data['username'] = user.username or user.first_name
-    update_user(user_data)
+    user_data = await change_user(user_id, username=user.username or user.first_name)
     
-    await update.message.reply_text(
+    reply(
+        update.message,
         f"✨ Welcome {user.first_name} to Anime NGuess! ✨\n\n"
         f"💰 <b>Your Coins:</b> {user_data['coins']}\n"
         f"🔥 <b>Current Strike:</b> {user_data['current_strike']}\n"
@@ -289,7 +183,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"2. You'll see an anime character image\n"
         f"3. Type the character name to guess\n"
         f"4. Earn coins for correct guesses!\n\n"
-        f"⏱️ <b>Time Limit:</b> 30 seconds per round\n"
+        f"⏱️ <b>Time Limit:</b> {TIME_LIMIT} seconds per round\n"
         f"💰 <b>Coin Rewards:</b>\n"
         f"• Base: 20 coins per correct guess\n"
         f"• 10 strikes: 200 coins 🎉\n"
@@ -302,179 +196,270 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• /splay - Start new game\n"
         f"• /sprofile - Your stats\n"
         f"• /sleaderboard - Top players\n"
+        f"• /sstats - Hardest and easiest characters\n"
         f"• /sadd - Add character\n"
         f"• /slist - All characters\n"
         f"• /shelp - Show this help",
+        # The welcome carries this user's name and stats
+        coalesce=('help', user_id),
         parse_mode="HTML"
     )
 
 async def splay_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /splay command"""
     chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
+    user = update.effective_user
     
-    print(f"\n🎮 /splay from user {user_id} in chat {chat_id}")
+    logger.debug("command=splay user=%s chat=%s", user.id, chat_id)
+    
+    # The strike picks the difficulty; load it before the check below so
+    # nothing awaits between the check and the game starting
+    user_data = await get_user(user.id)
     
     # Check if game already active
     active_game = get_active_game(chat_id)
     if active_game:
-        print(f"❌ Game already active")
-        await update.message.reply_text("⚠️ A game is already running! Guess the character.")
+        reply(update.message, "⚠️ A game is already running! Guess the character.", coalesce='running')
         return
     
-    # Get random character
-    character = get_random_character()
+    start_round(chat_id, user.id, user.username or user.first_name, strike=user_data['current_strike'])
+
+def start_round(chat_id, user_id, username, character=None, strike=None):
+    """Pick a character (unless prefetched), start the game and queue its image"""
+    if character is None:
+        character = get_random_character(chat_id, strike)
     if not character:
-        print(f"❌ No characters in database")
-        await update.message.reply_text("❌ No characters added yet! Use /sadd to add characters.")
+        logger.warning("no characters in database")
+        send('send_message', chat_id, text="❌ No characters added yet! Use /sadd to add characters.")
         return
     
-    print(f"✅ Character selected: '{character['name']}'")
+    # Start the game before any await so a concurrent /splay sees it
+    round_id = start_game(chat_id, user_id, character)
     
+    # The image may wait in the send queue; do that off the calling handler
+    schedule(('round_image', round_id), 0, send_round, chat_id, user_id, username, character, round_id)
+
+async def send_round(chat_id, user_id, username, character, round_id):
+    """Send a started round's image, then arm its timer"""
     # Get user data
-    user_data = get_user(user_id)
-    user_data['username'] = update.effective_user.username or update.effective_user.first_name
-    user_data['games_played'] += 1
+    user_data = await get_user(user_id)
     
-    # Start game in database
-    start_game(chat_id, user_id, character)
+    # Long strikes get a cropped, blurred or silhouetted image once rendered
+    variant = None
+    if VARIANT_STRIKE and user_data['current_strike'] >= VARIANT_STRIKE and character.get('image_hash'):
+        from images import pick_variant
+        variant = pick_variant(character['image_hash'])
+    hint = f"🧩 <b>Hard image:</b> {variant}\n" if variant else ""
     
     # Send image
     try:
-        await update.message.reply_photo(
-            photo=open(character['image_path'], 'rb'),
-            caption=f"🎮 <b>Guess the Anime Character!</b>\n"
-                   f"⏱️ <b>30 seconds</b>\n\n"
-                   f"🔥 <b>Current Strike:</b> {user_data['current_strike']}\n"
-                   f"💰 <b>Next Reward:</b> {calculate_coins(user_data['current_strike'] + 1)} coins\n\n"
-                   f"💡 <i>Type the character name below...</i>",
-            parse_mode="HTML"
+        await send_character_photo(
+            chat_id,
+            character,
+            f"🎮 <b>Guess the Anime Character!</b>\n"
+            f"⏱️ <b>{TIME_LIMIT} seconds</b>\n{hint}\n"
+            f"🔥 <b>Current Strike:</b> {user_data['current_strike']}\n"
+            f"💰 <b>Next Reward:</b> {calculate_coins(user_data['current_strike'] + 1)} coins\n\n"
+            f"💡 <i>Type the character name below...</i>"
         )
     except Exception as e:
-        print(f"❌ Error sending image: {e}")
-        end_game(chat_id)
-        await update.message.reply_text(f"❌ Error loading image: {str(e)}")
+        logger.error("image send failed chat=%s character=%s: %s", chat_id, character['id'], e)
+        resolve_round(chat_id, round_id)
+        send('send_message', chat_id, HIGH, text=f"❌ Error loading image: {str(e)}")
         return
+    mark_shown(chat_id, round_id)
     
     # Save user data
-    update_user(user_data)
+    await change_user(user_id, username=username, games_played=1)
     
-    print(f"✅ Game started successfully")
+    inc('rounds_total', event='started')
+    logger.debug("round started chat=%s user=%s character=%s round=%s", chat_id, user_id, character['id'], round_id)
     
-    # Set timeout task
-    async def timeout_game():
-        await asyncio.sleep(30)
-        
-        active_game = get_active_game(chat_id)
-        if active_game:
-            print(f"⏰ Timeout for chat {chat_id}")
-            await context.bot.send_message(
-                chat_id,
-                f"⏰ <b>Time's up!</b>\n"
-                f"The character was: <b>{active_game['character_name']}</b>\n"
-                f"❌ <b>Strike reset to 0!</b>",
-                parse_mode="HTML"
-            )
-            # Reset user strike
-            user_data = get_user(user_id)
-            user_data['current_strike'] = 0
-            update_user(user_data)
-            end_game(chat_id)
-    
-    # Run timeout in background
-    asyncio.create_task(timeout_game())
+    # Arm the round timer (unless a guess already ended the round)
+    arm_round(chat_id, round_id, TIME_LIMIT, round_timeout)
+
+async def next_round(chat_id, user_id, username, character):
+    """Deferred auto-advance after a correct guess"""
+    # Someone may have used /splay during the pause
+    if get_active_game(chat_id):
+        return
+    start_round(chat_id, user_id, username, character)
+
+async def round_timeout(chat_id, round_id):
+    """End a round whose time limit ran out"""
+    # A correct guess may have resolved this round already
+    active_game = resolve_round(chat_id, round_id)
+    if not active_game:
+        return
+
+    inc('rounds_total', event='timeout')
+    logger.debug("round timed out chat=%s round=%s", chat_id, round_id)
+    record_round(chat_id, active_game['user_id'], active_game['character_id'], 'timeout', TIME_LIMIT)
+
+    # Reset user strike
+    await change_user(active_game['user_id'], strike='reset')
+
+    send(
+        'send_message',
+        chat_id,
+        HIGH,
+        text=f"⏰ <b>Time's up!</b>\n"
+             f"The character was: <b>{active_game['character_name']}</b>\n"
+             f"❌ <b>Strike reset to 0!</b>",
+        parse_mode="HTML"
+    )
+
+def expire_rounds(expired):
+    """Close rounds whose time ran out while the bot was down"""
+    for chat_id, game in expired:
+        inc('rounds_total', event='expired')
+        # The player never got the full time: logged, but no timeout in
+        # the stats and the strike stands
+        record_round(chat_id, game['user_id'], game['character_id'], 'expired', TIME_LIMIT)
+        send(
+            'send_message',
+            chat_id,
+            HIGH,
+            text=f"⏰ <b>Time's up!</b> The bot restarted during this round.\n"
+                 f"The character was: <b>{game['character_name']}</b>\n"
+                 f"🔥 <b>Your strike is kept.</b> Use /splay to play again!",
+            parse_mode="HTML"
+        )
 
 async def sprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /sprofile command"""
     user_id = update.effective_user.id
-    user_data = get_user(user_id)
-    
-    print(f"\n📊 /sprofile from user {user_id}")
+    user_data = await get_user(user_id)
+    stats = await get_player_stats(user_id)
+    
+    rounds = ""
+    if stats['rounds']:
+        rounds = (
+            f"🎯 <b>Solve Rate:</b> {stats['correct'] * 100 // stats['rounds']}% "
+            f"({stats['wrong']} wrong, {stats['timeouts']} timed out)\n"
+        )
+    if stats['correct']:
+        rounds += (
+            f"⚡ <b>Avg Solve Time:</b> {stats['solve_ms'] / stats['correct'] / 1000:.1f}s | "
+            f"<b>Fastest:</b> {stats['fastest_ms'] / 1000:.1f}s\n"
+        )
     
-    await update.message.reply_text(
+    reply(
+        update.message,
         f"📊 <b>Your Stats</b>\n\n"
         f"👤 <b>Player:</b> {user_data['username']}\n"
         f"💰 <b>Coins:</b> {user_data['coins']}\n"
         f"🔥 <b>Current Strike:</b> {user_data['current_strike']}\n"
         f"🏆 <b>Best Strike:</b> {user_data['best_strike']}\n"
         f"✅ <b>Correct Answers:</b> {user_data['total_correct']}\n"
-        f"🎮 <b>Games Played:</b> {user_data['games_played']}\n\n"
+        f"🎮 <b>Games Played:</b> {user_data['games_played']}\n"
+        f"{rounds}\n"
         f"🎁 <b>Next Milestone:</b>\n",
+        coalesce=('profile', user_id),
         parse_mode="HTML"
     )
 
 async def sleaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /sleaderboard command"""
-    print(f"\n🏆 /sleaderboard command")
+    """Handle /sleaderboard [coins|strike|correct|chat] command"""
+    mode = context.args[0].lower() if context.args else 'coins'
+    if mode != 'chat' and mode not in LEADERBOARD_MODES:
+        reply(update.message, "Usage: /sleaderboard [coins|strike|correct|chat]")
+        return
     
-    top_users = get_top_users(10)
+    user_id = update.effective_user.id
+    if mode == 'chat':
+        chat_id = update.effective_chat.id
+        leaderboard = await get_chat_leaderboard_text(chat_id)
+        rank = await get_chat_rank(chat_id, user_id) if leaderboard else None
+    else:
+        leaderboard = get_leaderboard_text(mode)
+        rank = await get_rank(mode, await get_user(user_id)) if leaderboard else None
     
-    if not top_users:
-        await update.message.reply_text("📊 No players yet! Be the first to play!")
+    if not leaderboard:
+        reply(update.message, "📊 No players yet! Be the first to play!", coalesce='leaderboard')
         return
     
-    leaderboard = "🏆 <b>Top 10 Players</b>\n\n"
+    if rank:
+        leaderboard += f"📍 <b>Your Rank:</b> #{rank}"
     
-    for i, (username, coins, best_strike, total_correct) in enumerate(top_users, 1):
-        medal = ""
-        if i == 1: medal = "🥇"
-        elif i == 2: medal = "🥈"
-        elif i == 3: medal = "🥉"
-        else: medal = f"{i}."
-        
-        display_name = username or f"Player{i}"
-        if len(display_name) > 15:
-            display_name = display_name[:12] + "..."
-        
-        leaderboard += f"{medal} <b>{display_name}</b>\n"
-        leaderboard += f"   💰 {coins} coins | 🔥 {best_strike} strikes | ✅ {total_correct}\n\n"
+    reply(update.message, leaderboard, coalesce=('leaderboard', mode, user_id), parse_mode="HTML")
+
+async def sstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /sstats command: hardest and easiest characters"""
+    (played, rounds, correct, solve_ms), hardest, easiest = await get_character_stats()
+    if not rounds:
+        reply(update.message, "📊 No rounds played yet!", coalesce='sstats')
+        return
     
-    await update.message.reply_text(leaderboard, parse_mode="HTML")
+    def describe(row):
+        name, char_rounds, char_correct, char_solve_ms, _ = row
+        line = f"<b>{html.escape(name)}</b>: {char_correct * 100 // char_rounds}% of {char_rounds}"
+        if char_correct:
+            line += f" | avg {char_solve_ms / char_correct / 1000:.1f}s"
+        return line
+    
+    lines = [
+        "📊 <b>Round Stats</b>\n",
+        f"🎮 <b>Rounds:</b> {rounds} over {played} characters",
+        f"🎯 <b>Solve Rate:</b> {correct * 100 // rounds}%"
+    ]
+    if correct:
+        lines.append(f"⚡ <b>Avg Solve Time:</b> {solve_ms / correct / 1000:.1f}s")
+    if hardest:
+        lines.append("\n🧠 <b>Hardest Characters</b>")
+        lines.extend(describe(row) for row in hardest)
+    if easiest:
+        lines.append("\n🍀 <b>Easiest Characters</b>")
+        lines.extend(describe(row) for row in easiest)
+    
+    reply(update.message, "\n".join(lines), coalesce='sstats', parse_mode="HTML")
 
 async def sadd_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /sadd command"""
     user_id = update.effective_user.id
     owner_id = os.getenv("OWNER_ID")
     
-    print(f"\n➕ /sadd from user {user_id}")
-    
     # Check if user is owner
     if not owner_id or str(user_id) != owner_id:
-        await update.message.reply_text("❌ Only the bot owner can add characters!")
+        reply(update.message, "❌ Only the bot owner can add characters!")
         return
     
     if not context.args:
-        await update.message.reply_text("Usage: Reply to an image with /sadd <character name>")
+        reply(update.message, "Usage: Reply to an image with /sadd <character name>")
         return
     
     if not update.message.reply_to_message or not update.message.reply_to_message.photo:
-        await update.message.reply_text("❌ Please reply to an image!")
+        reply(update.message, "❌ Please reply to an image!")
         return
     
     char_name = " ".join(context.args).strip()
     
-    # Create images directory
-    os.makedirs("images", exist_ok=True)
-    
     # Download image
     photo = update.message.reply_to_message.photo[-1]
     file = await photo.get_file()
     
-    # Create safe filename
-    safe_name = char_name.lower().replace(" ", "_").replace(".", "")
-    image_path = f"images/{safe_name}.jpg"
+    # Owner-only paths import the image pipeline (Pillow) on first use
+    from images import preprocess, queue_variants
+    from image_store import store_image
     
     try:
-        await file.download_to_drive(image_path)
+        data = await file.download_as_bytearray()
+        # Re-encode, strip metadata and store by content hash off the event loop
+        loop = asyncio.get_running_loop()
+        image, image_hash = await loop.run_in_executor(None, preprocess, bytes(data))
+        image_path = await loop.run_in_executor(None, store_image, image, image_hash)
     except Exception as e:
-        await update.message.reply_text(f"❌ Error downloading image: {str(e)}")
+        reply(update.message, f"❌ Error downloading image: {str(e)}")
         return
     
     # Add to database
-    success = add_character(char_name, image_path)
+    success = await add_character(char_name, image_path, photo.file_id, image_hash)
     
     if success:
-        await update.message.reply_text(
+        queue_variants(image_path, image_hash)
+        invalidate_pages()
+        reply(
+            update.message,
             f"✅ <b>Character Added Successfully!</b>\n\n"
             f"🎮 <b>Name:</b> {char_name}\n"
             f"📁 <b>Saved as:</b> {image_path}\n\n"
@@ -482,39 +467,112 @@ async def sadd_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="HTML"
         )
     else:
-        await update.message.reply_text("⚠️ This character already exists!")
+        reply(update.message, "⚠️ This character already exists!")
+
+async def simport_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /simport command (owner only): bulk import from a manifest or ZIP"""
+    user_id = update.effective_user.id
+    owner_id = os.getenv("OWNER_ID")
+    
+    if not owner_id or str(user_id) != owner_id:
+        reply(update.message, "❌ Only the bot owner can import characters!")
+        return
+    
+    replied = update.message.reply_to_message
+    if not replied or not replied.document:
+        reply(
+            update.message,
+            "Usage: Reply to a JSON/JSONL/CSV manifest or a ZIP of images with /simport"
+        )
+        return
+    
+    reply(update.message, "📦 Import started...")
+    
+    from importer import import_manifest, format_report
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, os.path.basename(replied.document.file_name or "manifest.json"))
+        try:
+            file = await replied.document.get_file()
+            await file.download_to_drive(path)
+        except Exception as e:
+            reply(update.message, f"❌ Error downloading file: {str(e)}")
+            return
+        
+        # Fetching and inserting block, so run the whole pipeline off the loop
+        report = await asyncio.get_running_loop().run_in_executor(None, import_manifest, path)
+    
+    add_records(report['imported'])
+    if report['imported']:
+        invalidate_pages()
+    
+    reply(update.message, format_report(report))
 
 async def slist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /slist command"""
-    print(f"\n📋 /slist command")
+    page = await get_roster_page()
+    if not page:
+        reply(update.message, "❌ No characters added yet!")
+        return
     
-    characters = get_all_characters()
+    text, keyboard = page
+    reply(update.message, text, coalesce='slist', reply_markup=keyboard, parse_mode="HTML")
+
+async def slist_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /slist page and letter buttons"""
+    query = update.callback_query
+    await query.answer()
     
-    if not characters:
-        await update.message.reply_text("❌ No characters added yet!")
+    page = await get_roster_page(query.data.removeprefix("slist:"))
+    if not page:
         return
     
-    total = len(characters)
-    text = f"📋 <b>All Characters ({total})</b>\n\n"
+    text, keyboard = page
+    # Rapid presses on one message only send the last page; "message is
+    # not modified" (same page pressed again) is a BadRequest, not retried
+    send(
+        'edit_message_text',
+        query.message.chat_id,
+        coalesce=('slist', query.message.message_id),
+        message_id=query.message.message_id,
+        text=text,
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
+
+async def smetrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /smetrics command (owner only): how long handlers stay busy"""
+    user_id = update.effective_user.id
+    owner_id = os.getenv("OWNER_ID")
     
-    # Group by first letter
-    char_dict = {}
-    for char in characters:
-        first_letter = char[0].upper()
-        if first_letter not in char_dict:
-            char_dict[first_letter] = []
-        char_dict[first_letter].append(char)
+    if not owner_id or str(user_id) != owner_id:
+        reply(update.message, "❌ Only the bot owner can view metrics!")
+        return
     
-    for letter in sorted(char_dict.keys()):
-        text += f"<b>{letter}</b>\n"
-        for char in sorted(char_dict[letter]):
-            text += f"• {char}\n"
-        text += "\n"
+    timings = snapshot('handler_seconds')
+    if not timings:
+        reply(update.message, "📈 No metrics recorded yet!")
+        return
     
-    if len(text) > 4000:
-        text = text[:4000] + "\n... (truncated)"
+    lines = ["📈 <b>Handler Busy Time</b>\n"]
+    for name, (count, total, longest) in sorted(timings.items()):
+        lines.append(
+            f"<b>{name}</b>: {count} calls | "
+            f"avg {total / count * 1000:.1f} ms | max {longest * 1000:.1f} ms"
+        )
     
-    await update.message.reply_text(text, parse_mode="HTML")
+    rounds = counters('rounds_total')
+    if rounds:
+        lines.append("\n🎮 <b>Rounds</b>")
+        lines.append(" | ".join(f"{event}: {count}" for event, count in sorted(rounds.items())))
+    
+    db = sorted(snapshot('db_seconds').items(), key=lambda item: item[1][1], reverse=True)
+    if db:
+        lines.append("\n🗄️ <b>Slowest DB Functions (total time)</b>")
+        for name, (count, total, longest) in db[:5]:
+            lines.append(f"<b>{name}</b>: {count} calls | avg {total / count * 1000:.2f} ms")
+    
+    reply(update.message, "\n".join(lines), parse_mode="HTML")
 
 async def shelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /shelp command"""
@@ -530,52 +588,49 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
     
-    print(f"\n📨 Message received: '{text}' from {user_id} in {chat_id}")
-    
     # Check if it's a command
     if text.startswith('/'):
-        print(f"📝 It's a command, skipping...")
         return
     
     # Check if there's an active game
     active_game = get_active_game(chat_id)
     if not active_game:
-        print(f"❌ No active game in this chat")
         return
     
-    print(f"✅ Active game found. Answer: '{active_game['character_name']}'")
-    
     # Check if this user started the game
     if active_game['user_id'] != user_id:
-        print(f"❌ Wrong user. Game started by {active_game['user_id']}")
-        await update.message.reply_text("⚠️ This game was started by someone else!")
+        reply(update.message, "⚠️ This game was started by someone else!", coalesce='wrong_user')
+        return
+    
+    correct = match_guess(text, active_game['match'])
+    
+    # Claim the round before any await: only one guess (or the timer) wins it
+    if resolve_round(chat_id, active_game['round_id']) is None:
         return
+    record_round(
+        chat_id,
+        user_id,
+        active_game['character_id'],
+        'correct' if correct else 'wrong',
+        response_time(active_game)
+    )
     
     # Check the guess
-    if check_guess(text, active_game['character_name']):
-        print(f"✅ CORRECT! User guessed '{text}'")
-        
-        # Get and update user data
-        user_data = get_user(user_id)
-        user_data['username'] = update.effective_user.username or update.effective_user.first_name
+    if correct:
+        inc('rounds_total', event='correct')
+        logger.debug("guess correct chat=%s user=%s round=%s", chat_id, user_id, active_game['round_id'])
         
-        # Calculate new strike and coins
-        new_strike = user_data['current_strike'] + 1
+        # Strike, coins and totals change as one increment
+        user_data = await change_user(
+            user_id,
+            username=update.effective_user.username or update.effective_user.first_name,
+            coins=calculate_coins,
+            total_correct=1,
+            strike='hit'
+        )
+        new_strike = user_data['current_strike']
         coins_earned = calculate_coins(new_strike)
-        
-        user_data['current_strike'] = new_strike
-        user_data['coins'] += coins_earned
-        user_data['total_correct'] += 1
-        
-        # Update best strike
-        if new_strike > user_data['best_strike']:
-            user_data['best_strike'] = new_strike
-        
-        # Save user data
-        update_user(user_data)
-        
-        # End current game
-        end_game(chat_id)
+        record_chat_coins(chat_id, user_id, coins_earned)
         
         # Send success message
         success_msg = f"✅ <b>Correct!</b> It was <b>{active_game['character_name']}</b>\n\n"
@@ -594,42 +649,134 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             }
             success_msg += f"\n{milestone_msgs[new_strike]}\n"
         
-        success_msg += f"\n🎮 <i>Next round in 3 seconds...</i>"
+        success_msg += f"\n🎮 <i>Next round in {NEXT_ROUND_DELAY} seconds...</i>"
         
-        await update.message.reply_text(success_msg, parse_mode="HTML")
+        reply(update.message, success_msg, HIGH, parse_mode="HTML")
         
-        # Start next round after delay
-        await asyncio.sleep(3)
-        await splay_command(update, context)
+        # Prefetch the next character now and start the round later,
+        # releasing this handler straight away
+        schedule(
+            ('next_round', chat_id),
+            NEXT_ROUND_DELAY,
+            next_round,
+            chat_id,
+            user_id,
+            user_data['username'],
+            get_random_character(chat_id, new_strike)
+        )
         
     else:
-        print(f"❌ WRONG! User guessed '{text}' but answer is '{active_game['character_name']}'")
+        inc('rounds_total', event='wrong')
+        logger.debug("guess wrong chat=%s user=%s round=%s", chat_id, user_id, active_game['round_id'])
         
         # Reset user strike
-        user_data = get_user(user_id)
-        user_data['current_strike'] = 0
-        update_user(user_data)
-        
-        # End game
-        end_game(chat_id)
+        await change_user(user_id, strike='reset')
         
-        await update.message.reply_text(
+        reply(
+            update.message,
             f"❌ <b>Wrong!</b> The answer was: <b>{active_game['character_name']}</b>\n"
             f"❌ <b>Strike reset to 0!</b>\n\n"
             f"Use /splay to start a new game!",
+            HIGH,
             parse_mode="HTML"
         )
 
 # =============== MAIN FUNCTION ===============
+async def on_startup(application: Application):
+    """Migrate the schema if needed, then warm the caches concurrently"""
+    start = time.perf_counter()
+    await run_db(init_db)
+    characters, _, games = await asyncio.gather(
+        load_characters(),
+        load_leaderboards(),
+        run_db(load_active_games, application.bot_data.get('owns_chat'))
+    )
+    start_flusher()
+    start_history()
+    start_sender(application.bot)
+    # Re-arm rounds that survived a restart, end the ones that ran out
+    expired = recover_rounds(TIME_LIMIT, round_timeout)
+    expire_rounds(expired)
+    logger.info(
+        "loaded %s characters, restored %s active games (%s expired) in %.0f ms",
+        characters, games - len(expired), len(expired), (time.perf_counter() - start) * 1000
+    )
+    await start_metrics_server()
+
+async def on_stop(application: Application):
+    """Freeze running rounds, then send queued messages while the bot can still reach Telegram"""
+    # A timer firing from here on would end a round whose message is dropped;
+    # shown rounds stay in active_games and their deadlines let a restart
+    # resume them; rounds whose image never went out are dropped
+    shutdown_scheduler()
+    save_deadlines()
+    await stop_sender()
+
+async def on_shutdown(application: Application):
+    """Drain pending DB work before the process exits"""
+    await stop_metrics_server()
+    if 'images' in sys.modules:
+        sys.modules['images'].shutdown_image_pool(wait=False)
+    await stop_flusher()
+    await stop_history()
+    await asyncio.get_running_loop().run_in_executor(None, shutdown_db)
+    logger.info("database closed")
+
+def build_application(token, request=None):
+    """Create the Application with every game handler registered"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
+
+    # Register handlers
+    application.add_handler(CommandHandler("start", timed_handler(start_command)))
+    application.add_handler(CommandHandler("splay", timed_handler(splay_command)))
+    application.add_handler(CommandHandler("sprofile", timed_handler(sprofile_command)))
+    application.add_handler(CommandHandler("sleaderboard", timed_handler(sleaderboard_command)))
+    application.add_handler(CommandHandler("sstats", timed_handler(sstats_command)))
+    application.add_handler(CommandHandler("sadd", timed_handler(sadd_command)))
+    application.add_handler(CommandHandler("simport", timed_handler(simport_command)))
+    application.add_handler(CommandHandler("slist", timed_handler(slist_command)))
+    application.add_handler(CallbackQueryHandler(timed_handler(slist_callback), pattern=r"^slist:"))
+    application.add_handler(CommandHandler("smetrics", timed_handler(smetrics_command)))
+    application.add_handler(CommandHandler("shelp", timed_handler(shelp_command)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(handle_text_message)))
+    return application
+
 def main():
     """Start the bot"""
     token = os.getenv("BOT_TOKEN")
     if not token:
-        print("❌ ERROR: BOT_TOKEN not set in environment variables!")
+        logger.error("BOT_TOKEN not set in environment variables")
         return
     
-    print("🚀 Starting Anime NGuess Bot...")
-    print(f"📱 Token: {token[:10]}...")
+    logger.info("starting Anime NGuess Bot")
     
-    # Create application
- 
+    if SHARD_WORKERS > 1:
+        from sharding import build_router
+        # Migrate once here so workers starting together find the schema current
+        init_db()
+        close_connection()
+        # This process only routes updates; workers build their own Application
+        application = build_router(token, SHARD_WORKERS)
+    else:
+        application = build_application(token)
+
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        logger.info("bot is running (webhook)")
+        run_webhook(application)
+    else:
+        logger.info("bot is running (polling)")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+if __name__ == "__main__":
+    main()
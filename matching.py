@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import unicodedata
+
+try:
+    from Levenshtein import distance as _levenshtein
+except ImportError:  # pragma: no cover - python-Levenshtein>=0.20 is in requirements.txt
+    _levenshtein = None
+
+# Shortest name part accepted on its own (avoids "Li" matching "Lin")
+MIN_PART_LENGTH = 3
+
+# Romaji long-vowel spellings folded to one form ("Kyouko", "Kyooko", "Kyoko")
+_LONG_VOWELS = (('ou', 'o'), ('oo', 'o'), ('uu', 'u'), ('aa', 'a'), ('ii', 'i'))
+
+# Katakana -> hiragana, so either script matches the other
+_KATAKANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+# =============== NORMALIZATION ===============
+def normalize(text):
+    """Fold case, width, accents, kana script, punctuation and long vowels"""
+    text = unicodedata.normalize('NFKD', text.casefold()).translate(_KATAKANA)
+    words = []
+    word = []
+    for char in text:
+        category = unicodedata.category(char)
+        if category[0] in 'LN':
+            word.append(char)
+        elif category == 'Mn':
+            continue  # accents: "Ō" -> "O"
+        elif char in "'’":
+            continue  # apostrophes join: "Ja'far" -> "jafar"
+        elif word:
+            words.append(''.join(word))
+            word = []
+    if word:
+        words.append(''.join(word))
+
+    text = ' '.join(words)
+    for long, short in _LONG_VOWELS:
+        text = text.replace(long, short)
+    return text
+
+def _max_distance(length):
+    """Edits tolerated for a form of this length"""
+    if length <= 4:
+        return 0
+    if length <= 8:
+        return 1
+    return 2
+
+# =============== INDEX ===============
+def build_index(name):
+    """Precompute the accepted forms of a character name
+
+    Returns (exact, fuzzy): a set of every accepted normalized form and a
+    tuple of (form, max_distance) pairs for typo-tolerant matching.
+    """
+    exact = set()
+    full = normalize(name)
+    if full:
+        parts = full.split()
+        exact.add(full)
+        exact.add(full.replace(' ', ''))
+        if len(parts) > 1:
+            # Family-name-first order and each of first / last name
+            exact.add(' '.join(reversed(parts)))
+            for part in (parts[0], parts[-1]):
+                if len(part) >= MIN_PART_LENGTH:
+                    exact.add(part)
+
+    fuzzy = tuple(
+        (form, _max_distance(len(form)))
+        for form in sorted(exact, key=len)
+        if _max_distance(len(form))
+    )
+    return frozenset(exact), fuzzy
+
+# =============== MATCHING ===============
+def match_guess(user_guess, index):
+    """Check a guess against a precomputed index"""
+    exact, fuzzy = index
+    guess = normalize(user_guess)
+    if not guess:
+        return False
+    if guess in exact:
+        return True
+
+    length = len(guess)
+    for form, max_distance in fuzzy:
+        # Forms are sorted by length; once too long, all later ones are too
+        if len(form) - length > max_distance:
+            break
+        if length - len(form) > max_distance:
+            continue
+        if _bounded_distance(guess, form, max_distance) <= max_distance:
+            return True
+    return False
+
+def _bounded_distance(a, b, limit):
+    """Edit distance, or any value above limit once it is exceeded"""
+    if _levenshtein is not None:
+        return _levenshtein(a, b, score_cutoff=limit)
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import os
+import time
+import bisect
+import asyncio
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+# Local Prometheus endpoint (METRICS_PORT=0 disables it)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_PREFIX = "nguess_"
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Metric name -> (type, help text)
+METRICS = {
+    'handler_seconds': ('histogram', "Time an update handler keeps its update busy"),
+    'db_seconds': ('histogram', "Time a DB function runs on the DB thread"),
+    'image_send_seconds': ('histogram', "Time to send a round image to Telegram"),
+    'rounds_total': ('counter', "Rounds by event: started, correct, wrong, timeout, expired"),
+    'send_wait_seconds': ('histogram', "Time an outbound message waits in the send queue"),
+    'messages_total': ('counter', "Outbound messages by outcome: sent, coalesced, retried, failed")
+}
+
+# (name, labels) -> [bucket counts..., count, total, max]. Recording is a
+# bisect and a few additions; text is only rendered when scraped.
+_histograms = {}
+# (name, labels) -> value
+_counters = {}
+_server = None
+
+# =============== RECORDING ===============
+def observe(name, seconds, **labels):
+    """Record one duration in a histogram"""
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = [0] * len(LATENCY_BUCKETS) + [0, 0.0, 0.0]
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    if bucket < len(LATENCY_BUCKETS):
+        histogram[bucket] += 1
+    histogram[-3] += 1
+    histogram[-2] += seconds
+    if seconds > histogram[-1]:
+        histogram[-1] = seconds
+
+def inc(name, amount=1, **labels):
+    """Increase a counter"""
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + amount
+
+def timed_handler(func):
+    """Wrap an update handler so the time it keeps the update busy is recorded"""
+    handler = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            observe('handler_seconds', time.perf_counter() - start, handler=handler)
+
+    return wrapper
+
+def snapshot(name='handler_seconds'):
+    """One histogram as {first label value: (count, total, max)}"""
+    return {
+        labels[0][1] if labels else '': tuple(histogram[-3:])
+        for (metric, labels), histogram in list(_histograms.items())
+        if metric == name
+    }
+
+def bucket_counts(name):
+    """One histogram's per-bucket counts summed over its labels; the last is above every bound"""
+    totals = [0] * (len(LATENCY_BUCKETS) + 1)
+    for (metric, _), histogram in list(_histograms.items()):
+        if metric == name:
+            for i, count in enumerate(histogram[:len(LATENCY_BUCKETS)]):
+                totals[i] += count
+            totals[-1] += histogram[-3] - sum(histogram[:len(LATENCY_BUCKETS)])
+    return totals
+
+def counters(name):
+    """One counter as {first label value: value}"""
+    return {
+        labels[0][1] if labels else '': value
+        for (metric, labels), value in list(_counters.items())
+        if metric == name
+    }
+
+# =============== PROMETHEUS ===============
+def _labels(labels, extra=()):
+    """Prometheus label set"""
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    histograms = sorted(list(_histograms.items()))
+    counter_values = sorted(list(_counters.items()))
+    for name, (kind, help_text) in METRICS.items():
+        full = METRICS_PREFIX + name
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in counter_values:
+                if metric == name:
+                    lines.append(f"{full}{_labels(labels)} {value}")
+            continue
+        for (metric, labels), histogram in histograms:
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram):
+                cumulative += count
+                lines.append(f"{full}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{full}_bucket{_labels(labels, [('le', '+Inf')])} {histogram[-3]}")
+            lines.append(f"{full}_sum{_labels(labels)} {histogram[-2]}")
+            lines.append(f"{full}_count{_labels(labels)} {histogram[-3]}")
+    return "\n".join(lines) + "\n"
+
+async def _handle_scrape(reader, writer):
+    """Answer one HTTP request with the metrics page"""
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    """Serve /metrics on METRICS_HOST:METRICS_PORT if a port is set"""
+    global _server
+    if METRICS_PORT and _server is None:
+        _server = await asyncio.start_server(_handle_scrape, METRICS_HOST, METRICS_PORT)
+        logger.info("metrics endpoint listening on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+async def stop_metrics_server():
+    """Stop the metrics endpoint"""
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
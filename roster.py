@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import html
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import database
+from characters import character_count, has_character
+
+# Names per /slist page
+PAGE_SIZE = 40
+# Letter jump buttons per keyboard row
+LETTERS_PER_ROW = 7
+
+# Rendered pages keyed by their callback cursor, plus the letter list;
+# both are dropped whenever the roster changes
+_pages = {}
+_letters = None
+
+# =============== CACHE ===============
+def invalidate_pages():
+    """Forget rendered pages after the roster changed"""
+    global _letters
+    _pages.clear()
+    _letters = None
+
+# =============== PAGES ===============
+async def get_page(cursor='first'):
+    """Rendered (text, keyboard) for a cursor, or None if the roster is empty
+
+    Cursors are 'first', 'n<id>' (after id), 'p<id>' (before id) and
+    'l<letter>' (jump to letter); they double as callback data.
+    """
+    page = _pages.get(cursor)
+    if page is not None:
+        return page
+
+    global _letters
+    if _letters is None:
+        _letters = await database.run_db(database.get_first_letters)
+
+    if cursor == 'first':
+        direction, value = 'first', None
+    else:
+        parsed = _parse(cursor)
+        if parsed is None:
+            # Callback data can be anything a client sends
+            return await get_page('first')
+        direction, value = parsed
+
+    rows, has_prev, has_next = await database.run_db(
+        database.get_character_page, direction, value, PAGE_SIZE
+    )
+    if not rows:
+        if direction == 'first':
+            return None
+        return await get_page('first')
+
+    page = (_render(rows), _keyboard(rows, has_prev, has_next))
+    # Cache only cursors the keyboards hand out, so made-up ids can not
+    # grow the cache
+    if direction in ('first', 'from') or has_character(value):
+        _pages[cursor] = page
+    return page
+
+def _parse(cursor):
+    """(direction, value) of an 'n', 'p' or 'l' cursor, or None if malformed"""
+    kind, rest = cursor[:1], cursor[1:]
+    if kind in ('n', 'p'):
+        try:
+            return ('after' if kind == 'n' else 'before'), int(rest)
+        except ValueError:
+            return None
+    if kind == 'l' and rest in _letters:
+        return 'from', rest
+    return None
+
+def _render(rows):
+    """Page text grouped by first letter"""
+    parts = [f"📋 <b>All Characters ({character_count()})</b>\n"]
+    letter = None
+    for _, name in rows:
+        first_letter = name[0].upper()
+        if first_letter != letter:
+            letter = first_letter
+            parts.append(f"\n<b>{html.escape(letter)}</b>\n")
+        parts.append(f"• {html.escape(name)}\n")
+    return "".join(parts)
+
+def _keyboard(rows, has_prev, has_next):
+    """Prev/next buttons plus one button per first letter"""
+    buttons = []
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Prev", callback_data=f"slist:p{rows[0][0]}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Next ▶️", callback_data=f"slist:n{rows[-1][0]}"))
+    if navigation:
+        buttons.append(navigation)
+
+    letters = [InlineKeyboardButton(l, callback_data=f"slist:l{l}") for l in _letters or ()]
+    for i in range(0, len(letters), LETTERS_PER_ROW):
+        buttons.append(letters[i:i + LETTERS_PER_ROW])
+    return InlineKeyboardMarkup(buttons)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import heapq
+import asyncio
+import logging
+import itertools
+
+logger = logging.getLogger(__name__)
+
+# One task drives every timer. Timers live in a heap ordered by deadline;
+# cancelling only drops the entry from _timers and the stale heap item
+# is skipped when it reaches the top.
+_heap = []
+_timers = {}
+_sequence = itertools.count()
+_wakeup = None
+_runner = None
+# Strong references to running callbacks
+_firing = set()
+
+# =============== TIMERS ===============
+def schedule(key, delay, callback, *args):
+    """Run `await callback(*args)` after `delay` seconds, replacing any timer for key"""
+    global _wakeup, _runner
+    loop = asyncio.get_running_loop()
+    cancel(key)
+    entry = (loop.time() + delay, next(_sequence), key)
+    _timers[key] = (entry, callback, args)
+    heapq.heappush(_heap, entry)
+
+    if _runner is None or _runner.done():
+        _wakeup = asyncio.Event()
+        _runner = loop.create_task(_run())
+    elif _heap[0] is entry:
+        # New earliest deadline; let the runner re-arm its sleep
+        _wakeup.set()
+
+def cancel(key):
+    """Cancel the timer for key; returns True if one was pending"""
+    return _timers.pop(key, None) is not None
+
+def pending():
+    """Number of armed timers"""
+    return len(_timers)
+
+def shutdown_scheduler():
+    """Drop every timer and stop the runner"""
+    global _runner
+    _timers.clear()
+    _heap.clear()
+    if _runner is not None:
+        _runner.cancel()
+        _runner = None
+
+# =============== RUNNER ===============
+async def _run():
+    """Sleep until the earliest deadline and fire due timers"""
+    loop = asyncio.get_running_loop()
+    while True:
+        # Discard cancelled or replaced heap entries
+        while _heap and _timers.get(_heap[0][2], (None,))[0] is not _heap[0]:
+            heapq.heappop(_heap)
+
+        if not _heap:
+            _wakeup.clear()
+            await _wakeup.wait()
+            continue
+
+        delay = _heap[0][0] - loop.time()
+        if delay > 0:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        entry = heapq.heappop(_heap)
+        _, callback, args = _timers.pop(entry[2])
+        # Run callbacks as their own tasks so a slow one never delays others
+        task = loop.create_task(_fire(callback, args))
+        _firing.add(task)
+        task.add_done_callback(_firing.discard)
+
+async def _fire(callback, args):
+    """Run one timer callback, reporting failures"""
+    try:
+        await callback(*args)
+    except Exception as e:
+        logger.exception("timer callback failed: %s", e)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""Outbound send queue: every message the bot sends goes through here.
+
+Telegram allows about 30 messages a second per bot, one a second in a
+private chat and 20 a minute in a group, and answers anything faster
+with RetryAfter. Messages wait in per-chat lanes and are released by
+token buckets, one global and one per chat, most urgent lane first:
+
+    HIGH - round images and round results, which keep games moving
+    LOW  - informational replies (warnings, profiles, leaderboards)
+
+A message sent with a coalesce key replaces a queued message of the same
+chat, lane and key instead of queueing behind it. RetryAfter pauses the
+chat and requeues the message; network errors are retried with
+exponential backoff. Time comes from a clock object (time() and
+sleep()), so the queue can be driven by a fake clock.
+"""
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from telegram.error import RetryAfter, BadRequest, NetworkError
+from metrics import observe, inc
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limits in messages per second (override with env vars; 0 = no limit)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+# Messages a chat may send back to back before its rate applies
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+# Attempts per message, and the first network-error backoff in seconds
+SEND_MAX_ATTEMPTS = 4
+SEND_BACKOFF = 0.5
+# Seconds stop_sender waits for queued messages to go out
+SEND_DRAIN_TIMEOUT = 10
+# Idle chats whose buckets are full are forgotten beyond this many
+CHAT_STATE_LIMIT = 10000
+
+# Lanes, most urgent first
+HIGH = 0
+LOW = 1
+LANE_NAMES = ('high', 'low')
+
+class LoopClock:
+    """Real time, from the event loop"""
+
+    def time(self):
+        return asyncio.get_running_loop().time()
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+
+class TokenBucket:
+    """`rate` tokens a second, holding at most `burst` (rate 0 = unlimited)"""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+        # Set by RetryAfter and backoff: no tokens before this time
+        self.paused_until = now
+
+    def _refill(self, now):
+        if self.rate and now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        wait = self.paused_until - now
+        if self.rate:
+            self._refill(now)
+            # Refills accumulate rounding error; a hair short of a token is one
+            if self.tokens < 1 - 1e-9:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(wait, 0.0)
+
+    def take(self, now):
+        """Use one token"""
+        if self.rate:
+            self._refill(now)
+            self.tokens -= 1
+
+    def pause(self, until):
+        """Hand out no tokens before `until`"""
+        self.paused_until = max(self.paused_until, until)
+
+    def idle(self, now):
+        """True when forgetting this bucket changes nothing"""
+        return self.wait_time(now) == 0 and (not self.rate or self.tokens >= self.burst)
+
+class _Chat:
+    """Queued messages and rate state of one chat"""
+
+    __slots__ = ('chat_id', 'lanes', 'bucket', 'filed', 'sending')
+
+    def __init__(self, chat_id, now):
+        self.chat_id = chat_id
+        self.lanes = (deque(), deque())
+        # Group and channel ids are negative
+        rate = SEND_GROUP_RATE if chat_id < 0 else SEND_CHAT_RATE
+        self.bucket = TokenBucket(rate, SEND_CHAT_BURST, now)
+        # Sequence number of this chat's live heap entry, None when unfiled
+        self.filed = None
+        # One call in flight per chat keeps its messages in order
+        self.sending = False
+
+    def lane(self):
+        """Most urgent non-empty lane, or None"""
+        for lane, messages in enumerate(self.lanes):
+            if messages:
+                return lane
+        return None
+
+# Chats that may send now, as (lane, seq, chat_id), and chats waiting for
+# a token, as (ready_at, seq, chat_id). A chat has one live entry; stale
+# ones (seq no longer chat.filed) are skipped when they reach the top.
+_ready = []
+_waiting = []
+_chats = {}
+_sequence = itertools.count()
+_bot = None
+_clock = LoopClock()
+_global = None
+_wakeup = None
+_runner = None
+# Strong references to sends in flight
+_sending = set()
+
+# =============== API ===============
+def start_sender(bot, clock=None):
+    """Send through `bot`, timed by `clock` (the event loop's by default)"""
+    global _bot, _clock, _global, _wakeup, _runner
+    _bot = bot
+    _clock = clock or LoopClock()
+    _global = TokenBucket(SEND_GLOBAL_RATE, max(SEND_GLOBAL_RATE, 1), _clock.time())
+    _wakeup = asyncio.Event()
+    _runner = asyncio.get_running_loop().create_task(_run())
+
+def send(method, chat_id, lane=LOW, coalesce=None, **kwargs):
+    """Queue `bot.<method>(chat_id=chat_id, **kwargs)`
+
+    Returns a future of the call's result. Awaiting it is optional;
+    failures are logged either way. Messages that share a coalesce key
+    share that future, so a key must cover only messages that are the
+    same for everyone who triggers them (add the user id otherwise).
+    """
+    now = _clock.time()
+    chat = _chats.get(chat_id)
+    if chat is None:
+        chat = _chats[chat_id] = _Chat(chat_id, now)
+
+    if coalesce is not None:
+        for message in chat.lanes[lane]:
+            if message['coalesce'] == coalesce:
+                # Still queued: send the newest content once, in the old slot
+                message['kwargs'] = kwargs
+                inc('messages_total', outcome='coalesced')
+                return message['future']
+
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(_retrieve)
+    message = {
+        'method': method,
+        'kwargs': kwargs,
+        'lane': lane,
+        'coalesce': coalesce,
+        'future': future,
+        'attempts': 0,
+        'queued_at': now
+    }
+    best = chat.lane()
+    chat.lanes[lane].append(message)
+    # Re-file when this message makes a ready chat more urgent
+    if not chat.sending and (
+        chat.filed is None or (lane < best and chat.bucket.wait_time(now) == 0)
+    ):
+        _file(chat, now)
+    _wakeup.set()
+    return future
+
+def reply(message, text, lane=LOW, coalesce=None, **kwargs):
+    """Queue a reply to `message`, quoting it outside private chats like reply_text"""
+    if message.chat.type != 'private':
+        kwargs.setdefault('reply_to_message_id', message.message_id)
+    return send('send_message', message.chat_id, lane, coalesce, text=text, **kwargs)
+
+def queued():
+    """Number of messages waiting to be sent"""
+    return sum(len(messages) for chat in _chats.values() for messages in chat.lanes)
+
+async def stop_sender():
+    """Send what is queued (up to SEND_DRAIN_TIMEOUT), then stop"""
+    global _runner
+    if _runner is None:
+        return
+    # Shutdown runs in real time, whatever clock paces the queue
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SEND_DRAIN_TIMEOUT
+    while (queued() or _sending) and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    _runner.cancel()
+    _runner = None
+    for chat in _chats.values():
+        for messages in chat.lanes:
+            for message in messages:
+                message['future'].cancel()
+            if messages:
+                logger.warning("dropped %s unsent messages chat=%s", len(messages), chat.chat_id)
+    _chats.clear()
+    _ready.clear()
+    _waiting.clear()
+
+def _retrieve(future):
+    """Mark a failure as handled; _deliver has logged it"""
+    if not future.cancelled():
+        future.exception()
+
+# =============== DISPATCHER ===============
+def _file(chat, now):
+    """Give a chat with queued messages its one live heap entry"""
+    seq = next(_sequence)
+    chat.filed = seq
+    wait = chat.bucket.wait_time(now)
+    if wait > 0:
+        heapq.heappush(_waiting, (now + wait, seq, chat.chat_id))
+    else:
+        heapq.heappush(_ready, (chat.lane(), seq, chat.chat_id))
+
+def _live(entry):
+    """True if a heap entry is its chat's current one"""
+    chat = _chats.get(entry[2])
+    return chat is not None and chat.filed == entry[1]
+
+async def _idle(timeout):
+    """Wait for a new message or until `timeout` seconds pass"""
+    _wakeup.clear()
+    tasks = {asyncio.ensure_future(_wakeup.wait())}
+    if timeout is not None:
+        tasks.add(asyncio.ensure_future(_clock.sleep(timeout)))
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _prune(now):
+    """Forget idle chats whose buckets have refilled"""
+    idle = [
+        chat_id for chat_id, chat in _chats.items()
+        if chat.filed is None and not chat.sending and chat.bucket.idle(now)
+    ]
+    for chat_id in idle:
+        del _chats[chat_id]
+
+async def _run():
+    """Release queued messages as the buckets allow"""
+    loop = asyncio.get_running_loop()
+    while True:
+        now = _clock.time()
+        while _waiting and _waiting[0][0] <= now:
+            entry = heapq.heappop(_waiting)
+            if _live(entry):
+                _file(_chats[entry[2]], now)
+        while _ready and not _live(_ready[0]):
+            heapq.heappop(_ready)
+
+        if not _ready:
+            if len(_chats) > CHAT_STATE_LIMIT:
+                _prune(now)
+            await _idle(_waiting[0][0] - now if _waiting else None)
+            continue
+
+        delay = _global.wait_time(now)
+        if delay > 0:
+            await _idle(delay)
+            continue
+
+        _, _, chat_id = heapq.heappop(_ready)
+        chat = _chats[chat_id]
+        chat.filed = None
+        chat.sending = True
+        message = chat.lanes[chat.lane()].popleft()
+        _global.take(now)
+        chat.bucket.take(now)
+
+        observe('send_wait_seconds', now - message['queued_at'], lane=LANE_NAMES[message['lane']])
+        # Each call runs as its own task so a slow one never holds up other chats
+        task = loop.create_task(_deliver(chat, message))
+        _sending.add(task)
+        task.add_done_callback(_sending.discard)
+
+async def _deliver(chat, message):
+    """Make one Bot API call, requeueing it on flood control or network errors"""
+    future = message['future']
+    message['attempts'] += 1
+    try:
+        result = await getattr(_bot, message['method'])(chat_id=chat.chat_id, **message['kwargs'])
+    except RetryAfter as e:
+        _retry(chat, message, e.retry_after, e)
+    except BadRequest as e:
+        # A NetworkError subclass, but retrying can not help
+        _fail(chat, message, e)
+    except NetworkError as e:
+        # A timed-out call may have been delivered; a duplicate beats a stalled round
+        _retry(chat, message, SEND_BACKOFF * 2 ** (message['attempts'] - 1), e)
+    except Exception as e:
+        _fail(chat, message, e)
+    else:
+        inc('messages_total', outcome='sent')
+        if not future.done():
+            future.set_result(result)
+    finally:
+        chat.sending = False
+        if chat.lane() is not None and _runner is not None:
+            _file(chat, _clock.time())
+            _wakeup.set()
+
+def _retry(chat, message, delay, error):
+    """Pause the chat and put the message back at the front of its lane"""
+    if message['attempts'] >= SEND_MAX_ATTEMPTS:
+        _fail(chat, message, error)
+        return
+    inc('messages_total', outcome='retried')
+    logger.debug("send retry chat=%s method=%s in %.1fs: %s", chat.chat_id, message['method'], delay, error)
+    chat.bucket.pause(_clock.time() + delay)
+    chat.lanes[message['lane']].appendleft(message)
+
+def _fail(chat, message, error):
+    """Give up on a message"""
+    inc('messages_total', outcome='failed')
+    # Re-rendering an unchanged /slist page is expected; every other
+    # failure (bad HTML, a deleted message being replied to) is a fault
+    harmless = isinstance(error, BadRequest) and "message is not modified" in str(error).lower()
+    level = logging.DEBUG if harmless else logging.WARNING
+    logger.log(level, "send failed chat=%s method=%s: %s", chat.chat_id, message['method'], error)
+    if not message['future'].done():
+        message['future'].set_exception(error)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Sharded mode: one router process, N game worker processes.
+
+The router receives updates (polling or webhook) and forwards each one to
+the worker that owns its chat. A chat always maps to the same worker and
+every worker handles its updates in order, so per-chat ordering holds.
+Workers share only the database: their user caches write through, and
+leaderboards and the roster are refreshed from it periodically.
+"""
+import os
+import json
+import signal
+import asyncio
+import hashlib
+import bisect
+import logging
+import multiprocessing
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# Virtual nodes per worker on the hash ring
+RING_REPLICAS = 100
+# Seconds between worker refreshes of shared state (leaderboards, roster)
+SHARD_REFRESH_INTERVAL = int(os.getenv("SHARD_REFRESH_INTERVAL", "30"))
+# Seconds to wait for a worker to exit on shutdown
+WORKER_JOIN_TIMEOUT = 15
+
+# =============== HASH RING ===============
+def _hash(key):
+    """Stable 64-bit hash (built-in hash() is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes"""
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted(
+            (_hash(f"{node}:{i}"), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        """Node owning a key"""
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+def shard_key(update):
+    """Routing key of an update: its chat, else its user, else itself"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+# =============== ROUTER ===============
+def build_router(token, workers, request=None, worker_request=None):
+    """Application that forwards every update to its shard's worker process
+
+    request replaces the router's Bot API transport and worker_request
+    (a picklable factory) each worker's, as main.build_application's
+    request does; the load test passes fakes.
+    """
+    context = multiprocessing.get_context('spawn')
+    ring = HashRing(range(workers))
+    queues = [context.Queue() for _ in range(workers)]
+    processes = []
+
+    async def route(update, _context):
+        queues[ring.node_for(shard_key(update))].put(update.to_json())
+
+    async def start_workers(application):
+        for index, queue in enumerate(queues):
+            process = context.Process(
+                target=_worker_main,
+                args=(index, workers, queue, token, worker_request),
+                name=f"shard-{index}",
+                daemon=True
+            )
+            process.start()
+            processes.append(process)
+        logger.info("routing updates to %s worker processes", workers)
+
+    async def stop_workers(application):
+        for queue in queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in processes:
+            await loop.run_in_executor(None, process.join, WORKER_JOIN_TIMEOUT)
+            if process.is_alive():
+                logger.warning("%s did not stop in time, terminating", process.name)
+                process.terminate()
+
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(start_workers)
+        .post_shutdown(stop_workers)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, route))
+    return application
+
+# =============== WORKER ===============
+def _worker_main(index, count, queue, token, request_factory=None):
+    """Entry point of a worker process"""
+    # The router owns signals and stops workers through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, count, queue, token, request_factory))
+
+async def _run_worker(index, count, queue, token, request_factory=None):
+    """Serve this shard's updates until the router sends None"""
+    # Imported here so the router process never loads the game modules
+    import users
+    import main
+    import sender
+    import metrics
+
+    # One endpoint per worker: METRICS_PORT + index
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += index
+    # Other workers change the same users: read them from storage and write
+    # every change (an SQL increment) straight through
+    users.USER_CACHE_SIZE = 0
+    # The bot-wide send limit is shared out; each chat's limit holds as is
+    # because a chat belongs to one worker
+    sender.SEND_GLOBAL_RATE /= count
+
+    ring = HashRing(range(count))
+    application = main.build_application(token, request_factory() if request_factory else None)
+    application.bot_data['owns_chat'] = lambda chat_id: ring.node_for(chat_id) == index
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    refresher = asyncio.create_task(_refresh_loop())
+    logger.info("worker %s ready", index)
+
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+            break
+        update = Update.de_json(json.loads(data), application.bot)
+        await application.update_queue.put(update)
+
+    refresher.cancel()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    logger.info("worker %s stopped", index)
+
+async def _refresh_loop():
+    """Pick up leaderboard and roster changes made by other workers"""
+    from characters import load_new_characters
+    from leaderboard import load_leaderboards
+    from roster import invalidate_pages
+
+    while True:
+        await asyncio.sleep(SHARD_REFRESH_INTERVAL)
+        try:
+            if await load_new_characters():
+                invalidate_pages()
+            await load_leaderboards()
+        except Exception as e:
+            logger.error("shard refresh failed: %s", e)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Storage backends behind database.get_connection().
+
+Every function in database.py talks to its connection through the same
+small DB-API subset: execute / executemany returning cursors with
+fetchone, fetchall, rowcount and lastrowid, `with conn:` for a
+transaction, and sqlite3.IntegrityError on constraint violations. Each
+backend provides exactly that, and all SQL is written in SQLite's dialect.
+
+Backends (STORAGE_BACKEND env var):
+    sqlite  - a local SQLite file at DB_PATH (default)
+    rqlite  - an rqlite node or cluster at RQLITE_URL, over its HTTP API;
+              run `python storage_server.py` for a local stand-in
+"""
+import os
+import json
+import select
+import sqlite3
+import http.client
+import urllib.parse
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+RQLITE_URL = os.getenv("RQLITE_URL", "http://localhost:4001")
+# Read consistency requested from rqlite: none, weak or strong
+RQLITE_CONSISTENCY = os.getenv("RQLITE_CONSISTENCY", "weak")
+RQLITE_TIMEOUT = 10
+
+def connect(path):
+    """Open a connection to the configured backend"""
+    if STORAGE_BACKEND == "sqlite":
+        return _connect_sqlite(path)
+    if STORAGE_BACKEND == "rqlite":
+        return RqliteConnection(RQLITE_URL)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+# =============== SQLITE ===============
+def _connect_sqlite(path):
+    """Local SQLite connection tuned for one writer thread"""
+    conn = sqlite3.connect(path, cached_statements=256)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+# =============== RQLITE ===============
+def _is_read(sql):
+    """True for statements that change nothing, so sending them twice is safe"""
+    return sql.lstrip()[:6].upper() in ('SELECT', 'PRAGMA')
+
+class RqliteCursor:
+    """Result of one statement sent to rqlite"""
+
+    def __init__(self):
+        self.rows = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _load(self, result):
+        """Fill in from one entry of rqlite's "results" list"""
+        error = result.get('error')
+        if error:
+            if 'constraint failed' in error:
+                raise sqlite3.IntegrityError(error)
+            raise sqlite3.OperationalError(error)
+        self.rows = [tuple(row) for row in result.get('values') or ()]
+        self.rowcount = result.get('rows_affected', -1)
+        self.lastrowid = result.get('last_insert_id')
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+class RqliteConnection:
+    """rqlite client with the sqlite3 connection interface database.py uses
+
+    rqlite runs a transaction as a single request, so writes made inside
+    `with conn:` are buffered and sent together when the block exits;
+    their cursors are filled in then. A read inside the block sends the
+    buffered writes first so it sees them.
+    """
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self._https = parts.scheme == 'https'
+        self._netloc = parts.netloc
+        self._base = parts.path.rstrip('/')
+        self._http = None
+        self._pending = None
+
+    def _request(self, statements, transaction=False):
+        """POST statements to /db/request and return the per-statement results"""
+        path = f"{self._base}/db/request?level={RQLITE_CONSISTENCY}"
+        if transaction:
+            path += "&transaction"
+        body = json.dumps(statements).encode()
+        reads_only = all(_is_read(statement[0]) for statement in statements)
+        for attempt in (1, 2):
+            if self._http is not None and self._closed_by_server():
+                self.close()
+            if self._http is None:
+                connection_class = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+                self._http = connection_class(self._netloc, timeout=RQLITE_TIMEOUT)
+            sent = False
+            try:
+                self._http.request('POST', path, body, {'Content-Type': 'application/json'})
+                sent = True
+                response = self._http.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (OSError, http.client.HTTPException):
+                self.close()
+                # Writes are often relative increments: once the whole request
+                # is out, rqlite may have applied it even though the answer
+                # was lost (a timeout), so only a request that never fully
+                # left, or a read, is safe to send again
+                if attempt == 2 or (sent and not reads_only):
+                    raise
+        if 'error' in payload:
+            raise sqlite3.OperationalError(payload['error'])
+        return payload['results']
+
+    def _closed_by_server(self):
+        """True if the server dropped the idle keep-alive connection
+
+        An idle connection has nothing to read unless the peer closed or
+        reset it, so this catches stale sockets before a write is sent.
+        """
+        sock = self._http.sock
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _send(self, statements, cursors, transaction):
+        """Run statements and load their results into cursors"""
+        results = self._request(statements, transaction)
+        for cursor, result in zip(cursors, results):
+            cursor._load(result)
+
+    def _flush(self):
+        """Send the writes buffered by the current transaction"""
+        pending, self._pending = self._pending, []
+        if pending:
+            self._send([s for s, _ in pending], [c for _, c in pending], True)
+
+    def execute(self, sql, parameters=()):
+        cursor = RqliteCursor()
+        statement = [sql, *parameters]
+        is_read = _is_read(sql)
+        if self._pending is not None:
+            if not is_read:
+                self._pending.append((statement, cursor))
+                return cursor
+            self._flush()
+        self._send([statement], [cursor], False)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        statements = [[sql, *parameters] for parameters in seq_of_parameters]
+        cursors = [RqliteCursor() for _ in statements]
+        if self._pending is not None:
+            self._pending.extend(zip(statements, cursors))
+        elif statements:
+            # Like sqlite3, all rows go in or none do
+            self._send(statements, cursors, True)
+        cursor = RqliteCursor()
+        cursor.rowcount = sum(max(c.rowcount, 0) for c in cursors)
+        return cursor
+
+    def commit(self):
+        if self._pending is not None:
+            self._flush()
+
+    def rollback(self):
+        if self._pending is not None:
+            self._pending = []
+
+    def close(self):
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def __enter__(self):
+        self._pending = []
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self._flush()
+        finally:
+            self._pending = None
+        return False
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Containerless stand-in for an rqlite node.
+
+Usage: python storage_server.py [--db PATH] [--host HOST] [--port PORT]
+
+Serves the part of rqlite's HTTP API the rqlite storage backend uses
+(/db/request, /db/execute, /db/query and /status) on top of one local
+SQLite file, so STORAGE_BACKEND=rqlite can be run and benchmarked
+without Docker or an rqlite binary. It is a single node: there is no
+replication, and consistency levels are accepted and ignored.
+"""
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 4001
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server owning one SQLite connection, used by one request at a time"""
+
+    daemon_threads = True
+
+    def __init__(self, address, db_path):
+        super().__init__(address, _Handler)
+        # Autocommit mode: transactions are opened explicitly per request
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.lock = threading.Lock()
+
+    def run_statements(self, statements, transaction):
+        """Execute [sql, *params] statements the way rqlite does"""
+        results = []
+        with self.lock:
+            if transaction:
+                self.conn.execute('BEGIN')
+            for statement in statements:
+                if isinstance(statement, str):
+                    statement = [statement]
+                try:
+                    cursor = self.conn.execute(statement[0], statement[1:])
+                except sqlite3.Error as e:
+                    results.append({'error': str(e)})
+                    if transaction:
+                        # rqlite stops at the first error and rolls back
+                        self.conn.execute('ROLLBACK')
+                        return results
+                    continue
+                if cursor.description is not None:
+                    results.append({
+                        'columns': [d[0] for d in cursor.description],
+                        'values': [list(row) for row in cursor.fetchall()]
+                    })
+                else:
+                    results.append({
+                        'last_insert_id': cursor.lastrowid,
+                        'rows_affected': cursor.rowcount
+                    })
+            if transaction:
+                self.conn.execute('COMMIT')
+        return results
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response as one segment; keep-alive clients would otherwise
+    # stall on delayed ACKs between the headers and the body
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in ('/db/request', '/db/execute', '/db/query'):
+            return self._reply(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+            statements = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            return self._reply(400, {'error': str(e)})
+        transaction = 'transaction' in urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        self._reply(200, {'results': self.server.run_statements(statements, transaction)})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/db/query':
+            query = urllib.parse.parse_qs(url.query).get('q', [''])[0]
+            return self._reply(200, {'results': self.server.run_statements([query], False)})
+        if url.path in ('/status', '/readyz'):
+            return self._reply(200, {'store': {'ready': True, 'node': 'stand-in'}})
+        self._reply(404, {'error': 'not found'})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_in_thread(db_path, host='127.0.0.1', port=0):
+    """Start a stand-in in a daemon thread; returns (server, url)"""
+    server = StandInServer((host, port), db_path)
+    threading.Thread(target=server.serve_forever, name="rqlite-stand-in", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local rqlite stand-in backed by SQLite")
+    parser.add_argument('--db', default='rqlite_standin.db', help="SQLite file to serve")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    server = StandInServer((args.host, args.port), args.db)
+    print(f"🗄️ rqlite stand-in serving {args.db} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import os
+from collections import OrderedDict
+import database
+import leaderboard
+from flusher import WriteBehind
+
+# Cache tuning (override with env vars)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))  # 0 = write-through
+USER_FLUSH_INTERVAL_MS = int(os.getenv("USER_FLUSH_INTERVAL_MS", "2000"))
+USER_FLUSH_BATCH = int(os.getenv("USER_FLUSH_BATCH", "200"))
+
+# LRU of user records, kept current with every change
+_cache = OrderedDict()
+# user_id -> changes not yet written. They are stored as increments
+# (see database.apply_user_changes), never as whole rows, so a flush can
+# not overwrite changes made elsewhere and eviction never loses them.
+_pending = {}
+# user_id -> changes made while its record is being loaded
+_loading = {}
+
+def _new_change():
+    """Empty pending change"""
+    return {
+        'username': None,
+        'coins': 0,
+        'total_correct': 0,
+        'games_played': 0,
+        'reset': False,
+        'strike': 0,
+        'best_strike': 0
+    }
+
+def _merge(change, step):
+    """Fold a later change into an earlier one"""
+    if step['username'] is not None:
+        change['username'] = step['username']
+    change['coins'] += step['coins']
+    change['total_correct'] += step['total_correct']
+    change['games_played'] += step['games_played']
+    if step['reset']:
+        change['reset'] = True
+        change['strike'] = step['strike']
+    else:
+        change['strike'] += step['strike']
+    change['best_strike'] = max(change['best_strike'], step['best_strike'])
+
+def _apply(user, change):
+    """Apply a change to a user record in place"""
+    if change['username'] is not None:
+        user['username'] = change['username']
+    user['coins'] += change['coins']
+    user['total_correct'] += change['total_correct']
+    user['games_played'] += change['games_played']
+    user['current_strike'] = (0 if change['reset'] else user['current_strike']) + change['strike']
+    user['best_strike'] = max(user['best_strike'], change['best_strike'], user['current_strike'])
+
+# =============== USER CACHE ===============
+async def _load(user_id):
+    """The live cached record of a user, loading it on a miss"""
+    user = _cache.get(user_id)
+    if user is not None:
+        _cache.move_to_end(user_id)
+        return user
+
+    # Write the user's pending change first; the DB thread runs work in
+    # order, so the load below sees it
+    change = _pending.pop(user_id, None)
+    if change is not None:
+        database.submit_db(database.apply_user_changes, [(user_id, change)])
+    # Changes made while the load is in flight are collected here, since
+    # the loaded row may not include them
+    missed = _new_change()
+    _loading.setdefault(user_id, []).append(missed)
+    try:
+        loaded = await database.run_db(database.get_user, user_id)
+    finally:
+        waiting = _loading[user_id]
+        waiting.remove(missed)
+        if not waiting:
+            del _loading[user_id]
+
+    # Another handler may have loaded it while we waited
+    user = _cache.get(user_id)
+    if user is None:
+        user = loaded
+        _apply(user, missed)
+        _store(user_id, user)
+    return user
+
+async def get_user(user_id):
+    """Get or create user, served from cache when possible"""
+    return dict(await _load(user_id))
+
+async def change_user(user_id, username=None, coins=0, total_correct=0, games_played=0, strike=None):
+    """Apply a change to a user's stats and return the updated record
+
+    strike is None, 'hit' (current strike + 1) or 'reset' (back to 0).
+    coins may be a function of the new current strike. Nothing awaits
+    between reading the record and changing it, so concurrent changes
+    to the same user all apply.
+    """
+    user = await _load(user_id)
+    step = _new_change()
+    step['username'] = username
+    step['reset'] = strike == 'reset'
+    step['strike'] = 1 if strike == 'hit' else 0
+    new_strike = (0 if step['reset'] else user['current_strike']) + step['strike']
+    step['coins'] = coins(new_strike) if callable(coins) else coins
+    step['total_correct'] = total_correct
+    step['games_played'] = games_played
+    step['best_strike'] = max(user['best_strike'], new_strike)
+
+    _apply(user, step)
+    _merge(_pending.setdefault(user_id, _new_change()), step)
+    for missed in _loading.get(user_id, ()):
+        _merge(missed, step)
+
+    leaderboard.record_user(user)
+    if USER_CACHE_SIZE == 0 or len(_pending) >= USER_FLUSH_BATCH:
+        flush_users()
+    return dict(user)
+
+def _store(user_id, user):
+    """Put a record in the cache, evicting least recently used entries"""
+    _cache[user_id] = user
+    _cache.move_to_end(user_id)
+    while len(_cache) > USER_CACHE_SIZE:
+        # Pending changes live in _pending, so evicted records need no write
+        _cache.popitem(last=False)
+
+def flush_users():
+    """Write all pending changes in one batched transaction"""
+    if not _pending:
+        return None
+    changes = list(_pending.items())
+    _pending.clear()
+    return database.submit_db(database.apply_user_changes, changes)
+
+# =============== BACKGROUND FLUSH ===============
+_flusher = WriteBehind(flush_users)
+
+def start_flusher():
+    """Flush pending changes every USER_FLUSH_INTERVAL_MS"""
+    _flusher.start(USER_FLUSH_INTERVAL_MS)
+
+async def stop_flusher():
+    """Stop the periodic flush and write out everything pending"""
+    await _flusher.stop()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import os
+import hmac
+import json
+import signal
+import asyncio
+import secrets
+import logging
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Webhook settings (override with env vars). Railway provides PORT, used
+# unless WEBHOOK_PORT is set explicitly.
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Public URL Telegram should post to (including WEBHOOK_PATH). When unset
+# the server runs without registering, for posting recorded updates locally.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Registered with Telegram and required on every update; generated at
+# startup when WEBHOOK_URL is set without one
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Without a URL or secret nothing authenticates updates, so the server
+# only listens on loopback unless told otherwise
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN") or ("0.0.0.0" if WEBHOOK_URL or WEBHOOK_SECRET else "127.0.0.1")
+# Parallel HTTPS connections Telegram may open to us
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Seconds to wait for in-flight requests when shutting down
+DRAIN_TIMEOUT = 10
+
+MAX_BODY_BYTES = 1024 * 1024
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+_STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable"
+}
+
+# =============== HTTP ===============
+def _response(status, body=b""):
+    """Raw HTTP/1.1 response bytes"""
+    return (
+        f"HTTP/1.1 {status} {_STATUS_TEXT[status]}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Content-Type: text/plain\r\n"
+        f"\r\n"
+    ).encode() + body
+
+async def _read_request(reader):
+    """Parse one request as (method, path, headers, body); None on EOF"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', '0'))
+    if length > MAX_BODY_BYTES:
+        return method, path, headers, None
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+class WebhookServer:
+    """Minimal asyncio HTTP server that feeds Telegram updates to an Application"""
+
+    def __init__(self, application):
+        self.application = application
+        self.accepting = True
+        self._server = None
+        # Connection task -> its writer
+        self._connections = {}
+        # Connections in the middle of a request (the rest are idle keep-alives)
+        self._busy = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, WEBHOOK_LISTEN, WEBHOOK_PORT
+        )
+        logger.info("webhook server listening on %s:%s%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    async def drain(self):
+        """Stop accepting connections and wait for in-flight requests"""
+        self.accepting = False
+        self._server.close()
+        # Closing an idle keep-alive connection ends its read loop at once
+        for task, writer in list(self._connections.items()):
+            if task not in self._busy:
+                writer.close()
+        if self._connections:
+            await asyncio.wait(set(self._connections), timeout=DRAIN_TIMEOUT)
+        for writer in list(self._connections.values()):
+            writer.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            # Telegram reuses connections, so serve requests until it closes
+            while self.accepting:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                self._busy.add(task)
+                writer.write(await self._handle_request(*request))
+                await writer.drain()
+                self._busy.discard(task)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            self._busy.discard(task)
+            writer.close()
+
+    async def _handle_request(self, method, path, headers, body):
+        """Validate one request and queue its update"""
+        if path.split('?', 1)[0] != WEBHOOK_PATH:
+            # Anything else is a health check (Railway probes "/")
+            return _response(200, b"ok") if method == "GET" else _response(404)
+        if method != "POST":
+            return _response(405)
+        if body is None:
+            return _response(413)
+        if WEBHOOK_SECRET and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET
+        ):
+            return _response(403)
+        if not self.accepting:
+            # Telegram retries non-2xx responses, so nothing is lost
+            return _response(503)
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return _response(400)
+        await self.application.update_queue.put(update)
+        return _response(200)
+
+# =============== RUNNER ===============
+async def _serve(application):
+    """Run the application behind the webhook server until SIGTERM/SIGINT"""
+    global WEBHOOK_SECRET
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        # A public endpoint must only take updates from Telegram
+        WEBHOOK_SECRET = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET not set, registering a generated one")
+    elif not WEBHOOK_SECRET and WEBHOOK_LISTEN not in ("127.0.0.1", "::1", "localhost"):
+        logger.warning("webhook server on %s accepts unauthenticated updates; set WEBHOOK_SECRET", WEBHOOK_LISTEN)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    server = WebhookServer(application)
+    await server.start()
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            secret_token=WEBHOOK_SECRET
+        )
+        logger.info("webhook registered at %s", WEBHOOK_URL)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    # Drain: no new requests, finish queued updates, then the usual shutdown.
+    # The webhook stays registered so Telegram holds updates for the next deploy.
+    logger.info("draining webhook server")
+    await server.drain()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+def run_webhook(application):
+    """Serve updates through the local webhook server"""
+    asyncio.run(_serve(application))